@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# @Time        : 2026/10/17 10:30
+# @File        : tsp_benchmark.py
+# @Description : 时间序列分割求解器的性能测试，在项目根目录下运行 python -m benchmark.tsp_benchmark
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.tsp import TSP, OnlineTSP, partition_acceleration, EXACT_ENGINE, BINSEG_ENGINE
+
+DEFAULT_LANES = (4, 8, 16, 32)
+DEFAULT_LENGTHS = (96, 672, 2688, 10000)
+DEFAULT_KS = (2, 4, 8, 12)
+ONLINE_ENGINE = 'online'
+
+
+def synthetic_lane_volume(lane_num: int, length: int, seed: int = 0) -> np.ndarray:
+    """
+    分段平稳的合成车道流量：随机生成若干时段的流量水平，叠加泊松噪声
+    """
+    rng = np.random.default_rng(seed)
+    period_num = int(rng.integers(2, 13))
+    bounds = np.sort(rng.choice(np.arange(1, length), size=min(period_num - 1, length - 1), replace=False))
+    levels = rng.uniform(20, 400, size=(lane_num, len(bounds) + 1))
+    period_index = np.searchsorted(bounds, np.arange(length), side='right')
+    return rng.poisson(levels[:, period_index]).astype(np.float64)
+
+
+def _solve_online(lane_volume: np.ndarray, k_partition: int) -> List[Tuple[np.float64, tuple]]:
+    solver = OnlineTSP(lane_volume.shape[0], max_partition=k_partition)
+    solver.extend(lane_volume)
+    return solver.all_partitions(k_partition)
+
+
+ENGINE_SOLVERS: Dict[str, Callable[[np.ndarray, int], List[Tuple[np.float64, tuple]]]] = {
+    EXACT_ENGINE: lambda lane_volume, k: TSP(lane_volume).all_partitions(k, engine=EXACT_ENGINE),
+    BINSEG_ENGINE: lambda lane_volume, k: TSP(lane_volume).all_partitions(k, engine=BINSEG_ENGINE),
+    ONLINE_ENGINE: _solve_online,
+}
+EXACT_ENGINES = (EXACT_ENGINE, ONLINE_ENGINE)  # 结果应与精确解完全一致的求解方式
+
+
+def _measure(func: Callable, *args):
+    """
+    分两次运行：第一次不开启tracemalloc计时，避免内存追踪拖慢计时；第二次只统计内存峰值
+    :return: 函数结果, 耗时(s), 内存峰值(byte)
+    """
+    start_time = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_benchmark(lanes: Sequence[int] = DEFAULT_LANES, lengths: Sequence[int] = DEFAULT_LENGTHS,
+                  ks: Sequence[int] = DEFAULT_KS, engines: Sequence[str] = tuple(ENGINE_SOLVERS),
+                  max_exact_length: Optional[int] = 4000, seed: int = 0) -> List[dict]:
+    """
+    在车道数量 × 序列长度 × 分割区间数量的网格上测试各求解方式
+    :param max_exact_length: 精确求解(exact/online)的最大序列长度，超出时跳过，None表示不限制
+    :return: 每个网格点与求解方式的测试记录
+    """
+    records = []
+    for lane_num in lanes:
+        for length in lengths:
+            lane_volume = synthetic_lane_volume(lane_num, length, seed)
+            for k in ks:
+                if k > length:
+                    continue
+                reference = None  # 精确解，用于核对其余求解方式
+                for engine in engines:
+                    record = {'engine': engine, 'lanes': lane_num, 'length': length, 'k': k}
+                    if engine in EXACT_ENGINES and max_exact_length is not None and length > max_exact_length:
+                        record['skipped'] = True
+                        records.append(record)
+                        continue
+                    partitions, elapsed, peak = _measure(ENGINE_SOLVERS[engine], lane_volume, k)
+                    cost, spilt = partitions[-1]
+                    record.update({'skipped': False, 'wall_time_sec': elapsed, 'peak_memory_byte': peak,
+                                   'cost': float(cost), 'spilt': list(spilt)})
+                    if reference is None and engine in EXACT_ENGINES:
+                        reference = partitions
+                    if reference is not None:
+                        record['equal_to_exact'] = all(this[1] == ref[1] and np.isclose(this[0], ref[0])
+                                                       for this, ref in zip(partitions, reference))
+                        record['cost_gap'] = float(cost - reference[-1][0])
+                    records.append(record)
+            print(f'lanes {lane_num}, length {length} finished')
+    return records
+
+
+def run_acceleration_benchmark(lanes: Sequence[int] = DEFAULT_LANES, lengths: Sequence[int] = DEFAULT_LENGTHS,
+                               max_partition: int = 10, max_exact_length: Optional[int] = 4000,
+                               seed: int = 0) -> List[dict]:
+    """
+    partition_acceleration(含拐点判断)的端到端测试
+    """
+    records = []
+    for lane_num in lanes:
+        for length in lengths:
+            lane_volume = synthetic_lane_volume(lane_num, length, seed)
+            for engine in (EXACT_ENGINE, BINSEG_ENGINE):
+                record = {'engine': engine, 'lanes': lane_num, 'length': length, 'max_partition': max_partition}
+                if engine == EXACT_ENGINE and max_exact_length is not None and length > max_exact_length:
+                    record['skipped'] = True
+                    records.append(record)
+                    continue
+                (best_k, spilt), elapsed, peak = _measure(partition_acceleration, lane_volume, max_partition, engine)
+                record.update({'skipped': False, 'wall_time_sec': elapsed, 'peak_memory_byte': peak,
+                               'best_k': best_k, 'spilt': list(spilt)})
+                records.append(record)
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of time series partition engines')
+    parser.add_argument('--lanes', type=int, nargs='+', default=list(DEFAULT_LANES))
+    parser.add_argument('--lengths', type=int, nargs='+', default=list(DEFAULT_LENGTHS))
+    parser.add_argument('--ks', type=int, nargs='+', default=list(DEFAULT_KS))
+    parser.add_argument('--engines', nargs='+', default=list(ENGINE_SOLVERS), choices=list(ENGINE_SOLVERS))
+    parser.add_argument('--max-exact-length', type=int, default=4000,
+                        help='skip exact/online engines beyond this length, 0 for no limit')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='tsp_benchmark.json')
+    args = parser.parse_args()
+
+    max_exact_length = args.max_exact_length or None
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'partition': run_benchmark(args.lanes, args.lengths, args.ks, args.engines, max_exact_length, args.seed),
+        'acceleration': run_acceleration_benchmark(args.lanes, args.lengths, max_partition=max(args.ks),
+                                                   max_exact_length=max_exact_length, seed=args.seed),
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    mismatch = [record for record in report['partition']
+                if record['engine'] in EXACT_ENGINES and record.get('equal_to_exact') is False]
+    print(f'report written to {args.output}, {len(mismatch)} exact engine mismatch')
+
+
+if __name__ == '__main__':
+    main()
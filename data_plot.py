@@ -10,7 +10,7 @@ from xml.etree import ElementTree as ET
 
 from lib.SPAT import Movement, Turn, Direction
 from src.lane_change import lane_volume_retrieve
-from process import read_file
+from utils.log_cache import read_file_cached
 
 
 class CacheList(list):
@@ -170,7 +170,7 @@ def main():
         33: Movement(Direction.WEST, Turn.STRAIGHT)
     }
     data_record = DataRecord(VALID_LANE_IDS, update_interval=60 * 60)
-    for stat in read_file(tf_data_path):
+    for stat in read_file_cached(tf_data_path):
         if not data_retrieve(stat[0], FILTER_DAY, VALID_LANE_IDS, data_record):
             break
 
@@ -4,7 +4,9 @@
 # @Description :
 from collections import namedtuple
 from dataclasses import dataclass
-from typing import List, Dict, Optional, Iterable
+from typing import List, Dict, Optional, Iterable, Sequence
+
+import numpy as np
 
 from lib.SPAT import Turn, Movement
 
@@ -94,6 +96,61 @@ class LaneFlowStorage:
         return lane_info
 
 
+class LaneAccumulator:
+    def __init__(self, lanes: Iterable[int]):
+        """
+        按车道累积数据的和与数量，内存占用与累积的数据量无关
+        :param lanes: 车道id
+        """
+        self.lanes = list(lanes)
+        self._lane_index = {lane: index for index, lane in enumerate(self.lanes)}
+        self._sum = np.zeros(len(self.lanes), dtype=np.float64)
+        self._count = np.zeros(len(self.lanes), dtype=np.int64)
+
+    def store(self, lane_id: int, value: float):
+        """不在车道列表中的数据被忽略"""
+        index = self._lane_index.get(lane_id)
+        if index is None:
+            return None
+        self._sum[index] += value
+        self._count[index] += 1
+
+    def store_batch(self, lane_ids: Sequence[int], values: Sequence[float]):
+        """批量存储一组车道数据，不在车道列表中的数据被忽略"""
+        indices = np.array([self._lane_index.get(lane_id, -1) for lane_id in lane_ids], dtype=np.int64)
+        valid = indices >= 0
+        indices = indices[valid]
+        np.add.at(self._sum, indices, np.asarray(values, dtype=np.float64)[valid])
+        np.add.at(self._count, indices, 1)
+
+    def count(self, lane_id: int) -> int:
+        return int(self._count[self._lane_index[lane_id]])
+
+    def mean(self, lane_id: int) -> float:
+        """车道数据均值，无数据时为0"""
+        index = self._lane_index[lane_id]
+        count = self._count[index]
+        return float(self._sum[index] / count) if count else 0
+
+    def means(self) -> np.ndarray:
+        """按车道顺序的全部均值，无数据的车道为0"""
+        return np.divide(self._sum, self._count, out=np.zeros_like(self._sum), where=self._count > 0)
+
+    def clear(self):
+        self._sum.fill(0)
+        self._count.fill(0)
+
+    def state(self) -> dict:
+        """可序列化的累积状态"""
+        return {'lanes': self.lanes, 'sum': self._sum.tolist(), 'count': self._count.tolist()}
+
+    def load_state(self, state: dict):
+        if list(state['lanes']) != self.lanes:
+            raise ValueError(f'lanes {state["lanes"]} in state mismatch {self.lanes}')
+        self._sum[:] = state['sum']
+        self._count[:] = state['count']
+
+
 class LaneFlowQueueStorage(LaneFlowStorage):
     def __init__(self, lanes: Iterable[int]):
         super().__init__(lanes)
@@ -13,8 +13,8 @@ from lib.state import TurnDemand, DayLanePlan, PlanDuration
 from src.lane_change import (StaticIntersectionController, DynamicIntersectionController, VarianceLane, LaneAllocation,
                              VMS)
 from src.connection import Connection
-from utils.process import read_file
-from utils.data_load import date_classify_date
+from utils.log_cache import read_file_cached
+from utils.data_load import load_history_flow_cached
 
 STRAIGHT_SAT_RATE = 1600
 TURN_SAT_RATE = 900
@@ -245,9 +245,10 @@ if __name__ == '__main__':
     normal3_pd = PlanDuration(LANE_MOVEMENT_MAPPING, 20, 24)
     day_lane_plan = DayLanePlan([peak1_pd, peak2_pd, peak3_pd, peak4_pd, normal1_pd, normal2_pd, normal3_pd])
 
-    assemble_avg_flow = date_classify_date('data/history',
-                                           {'weekdays': [4, 6, 7, 10, 11, 12], 'weekends': [8, 9], 'festivals': [5]}, 1,
-                                           [16, 17, 18, 19, 30, 31, 32, 33])
+    assemble_avg_flow = load_history_flow_cached('data/history',
+                                                 {'weekdays': [4, 6, 7, 10, 11, 12], 'weekends': [8, 9],
+                                                  'festivals': [5]}, 1,
+                                                 [16, 17, 18, 19, 30, 31, 32, 33])
 
     connection = Connection()
     controller = DynamicIntersectionController(variance_lanes=[v_lane_east, v_lane_west],
@@ -261,5 +262,5 @@ if __name__ == '__main__':
     #                    queue_handle=controller.update_from_queue)
     # connection.loop_start()
     tf_data_path = 'data/TrafficFlow_Logs3.log'
-    for stat in read_file(tf_data_path):
+    for stat in read_file_cached(tf_data_path):
         controller.update_from_traffic_flow(stat[0], publish=True)
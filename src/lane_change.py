@@ -4,14 +4,15 @@
 # @Description :
 import time
 
+import numpy as np
 from collections import defaultdict, namedtuple
 from typing import Tuple, List, Dict, Union, Optional, Callable
 
 from lib.SPAT import Turn, Direction, Movement
-from lib.state import TurnDemand, PlanDuration, DayLanePlan, LaneFlowQueueStorage, QueueData
+from lib.state import TurnDemand, PlanDuration, DayLanePlan, LaneFlowQueueStorage, QueueData, LaneAccumulator
 from lib.tool import logger
 from src.connection import Connection
-from utils.data_load import HistoryLaneFlow
+from utils.data_load import HistoryLaneFlow, MultiLaneHistoryFlow
 
 ABSOLUTE_SATURATION_DIFF = 0.35  # 流向饱和度不均判别阈差值
 RECOVER_SATURATION_DIFF = 0.5  # 恢复主要流向时对次要流向饱和度保护差值
@@ -223,6 +224,15 @@ def lane_volume_retrieve(lane_traffic_info: dict, stat_duration_sec: float):
     return lane_id, volume_hour
 
 
+def lane_volume_arrays(lanes: List[dict], stat_duration_sec: float) -> Tuple[List[int], np.ndarray]:
+    """
+    一条统计记录中全部车道的id与小时流量，与逐个调用lane_volume_retrieve结果一致
+    """
+    lane_ids = [lane_info['lane_no'] for lane_info in lanes]
+    volume_duration = np.array([lane_info['volume'] for lane_info in lanes], dtype=np.float64)
+    return lane_ids, volume_duration / stat_duration_sec * 3600
+
+
 def get_movement_sorted_lane(lane_movement_mapping: Dict[int, Movement]) -> Dict[Movement, List[int]]:
     movement_sorted_lanes = defaultdict(list)
     for lane_id, movement in lane_movement_mapping.items():
@@ -236,7 +246,7 @@ class IntersectionController:
         self.variance_lanes: Dict[Direction, VarianceLane] = {v_lane.direction: v_lane for v_lane in variance_lanes}
         self.lane_movement_mapping = lane_movement_mapping
         self.movement_sorted_lanes = get_movement_sorted_lane(lane_movement_mapping)
-        self.traffic_data_cache = {lane_id: [] for lane_id in lane_movement_mapping.keys()}
+        self.traffic_data_cache = LaneAccumulator(lane_movement_mapping.keys())
         self.queue_data_cache = {lane_id: [] for lane_id in lane_movement_mapping.keys()}
         self.update_interval_sec = update_interval_sec
         self.last_update_time = None
@@ -247,9 +257,7 @@ class IntersectionController:
         for movement, lanes_id in movement_sorted_lanes.items():
             movement_total_avg_flow = 0
             for lane_id in lanes_id:
-                stats = self.traffic_data_cache[lane_id]
-                avg_flow = sum(stats) / len(stats) if len(stats) else 0
-                movement_total_avg_flow += avg_flow
+                movement_total_avg_flow += self.traffic_data_cache.mean(lane_id)
 
             yield movement, movement_total_avg_flow
 
@@ -266,8 +274,7 @@ class IntersectionController:
                     f'进口道{direction}车道功能变换, 当前模式{"主要流向" if v_lane.vms_device.is_major else "次要流向"}')
                 change_flag = True
         # 清除缓存的数据
-        for cache in self.traffic_data_cache.values():
-            cache.clear()
+        self.traffic_data_cache.clear()
         return change_flag
 
     def update_from_traffic_flow(self, tf_data: dict):
@@ -275,16 +282,8 @@ class IntersectionController:
         if self.last_update_time is None:
             self.last_update_time = detect_start_time
         detect_duration = tf_data['cycle_time']
-        for lane_info in tf_data['lanes']:
-            lane_id, volume_hour = lane_volume_retrieve(lane_info, detect_duration)
-            if lane_id not in self.lane_movement_mapping:
-                continue
-
-            # movement = self.lane_movement_mapping[lane_id]
-            # if movement.direction not in self.variance_lanes:
-            #     continue
-
-            self.traffic_data_cache[lane_id].append(volume_hour)
+        # 不在车道映射中的车道由缓存忽略
+        self.traffic_data_cache.store_batch(*lane_volume_arrays(tf_data['lanes'], detect_duration))
 
         if detect_start_time - self.last_update_time >= self.update_interval_sec:
             self.calculate_movement_avg_flow_stat(self.movement_sorted_lanes)
@@ -320,12 +319,8 @@ class StaticIntersectionController(IntersectionController):
             self.last_update_time = detect_start_time
 
         detect_duration = tf_data['cycle_time']
-        for lane_info in tf_data['lanes']:
-            lane_id, volume_hour = lane_volume_retrieve(lane_info, detect_duration)
-            if lane_id not in self.lane_movement_mapping:
-                continue
-
-            self.traffic_data_cache[lane_id].append(volume_hour)
+        # 不在车道映射中的车道由缓存忽略
+        self.traffic_data_cache.store_batch(*lane_volume_arrays(tf_data['lanes'], detect_duration))
 
         if detect_start_time - self.last_update_time >= self.update_interval_sec:
             current_time = time.localtime(detect_start_time)
@@ -357,44 +352,69 @@ class StaticIntersectionController(IntersectionController):
 
 class DynamicIntersectionController(IntersectionController):
     def __init__(self, variance_lanes: List[VarianceLane], lane_movement_mapping: Dict[int, Movement],
-                 update_interval_sec: float, history_lane_flow: Dict[int, HistoryLaneFlow],
-                 history_lane_movement_mapping: DayLanePlan, plan_applied: bool = False, connection: Connection = None):
+                 update_interval_sec: float,
+                 history_lane_flow: Union[Dict[int, HistoryLaneFlow], MultiLaneHistoryFlow],
+                 history_lane_movement_mapping: DayLanePlan, plan_applied: bool = False, connection: Connection = None,
+                 online_update_alpha: Optional[float] = None, baseline_quantile: Optional[float] = None):
         """
 
         Args:
             variance_lanes:
             lane_movement_mapping:
             update_interval_sec:
-            history_lane_flow:
+            history_lane_flow: 车道历史流量, 按车道的HistoryLaneFlow会合并为MultiLaneHistoryFlow批量预测
             history_lane_movement_mapping:
             plan_applied:
             connection: MQTT连接
+            online_update_alpha: 每个更新时间窗结束后以该权重将实测流量并入历史流量, None时历史流量保持不变
+            baseline_quantile: 以该分位数流量作为预测的历史流量(需历史流量包含分位数直方图), None时使用平均流量
         """
         super().__init__(variance_lanes, lane_movement_mapping, update_interval_sec, history_lane_movement_mapping)
+        if not isinstance(history_lane_flow, MultiLaneHistoryFlow):
+            history_lane_flow = MultiLaneHistoryFlow.from_lane_flows(history_lane_flow)
+        if baseline_quantile is not None:
+            if history_lane_flow.sketch is None:
+                raise ValueError('baseline_quantile requires history lane flow built with quantile sketch')
+            if not 0 <= baseline_quantile <= 1:
+                raise ValueError(f'baseline quantile {baseline_quantile} out of range [0, 1]')
         self.history_lane_flow = history_lane_flow
         self.plan_applied = plan_applied  # TODO: 如果执行方案可直接影响车道功能, 将不使用预设车道方案而使用内部存储方案
         self.lane_flow_storage = LaneFlowQueueStorage(lane_movement_mapping.keys())
         self.connection = connection
+        self.online_update_alpha = online_update_alpha
+        self.baseline_quantile = baseline_quantile
 
     def calculate_movement_avg_flow_stat_predicted(self, movement_sorted_lanes: Dict[Movement, List[int]], **kwargs):
+        lane_ids = [lane_id for lanes_id in movement_sorted_lanes.values() for lane_id in lanes_id]
+        avg_flows = np.array([self.traffic_data_cache.mean(lane_id) for lane_id in lane_ids], dtype=np.float64)
+        last_step_flows = np.array([self.lane_flow_storage.get_lane_flow_last_step(lane_id) for lane_id in lane_ids],
+                                   dtype=np.float64)
+        last_step_flows[last_step_flows < 0] = np.nan  # 无上一时间步记录
+        predict_lane_flows = self.history_lane_flow.predict_one_step(kwargs['current_hour'], avg_flows,
+                                                                     kwargs['date_type'], last_step_flows,
+                                                                     lane_ids=lane_ids,
+                                                                     quantile=self.baseline_quantile).tolist()
+        for lane_id, avg_flow in zip(lane_ids, avg_flows.tolist()):
+            self.lane_flow_storage.record_flow(lane_id, avg_flow)
+        if self.online_update_alpha is not None:
+            self.update_history_online(lane_ids, avg_flows, kwargs['date_type'])
+
+        lane_offset = 0
         for movement, lanes_id in movement_sorted_lanes.items():
-            movement_total_avg_flow = 0
-            for lane_id in lanes_id:
-                stats = self.traffic_data_cache[lane_id]
-                avg_flow = sum(stats) / len(stats) if len(stats) else 0
-
-                last_step_flow = self.lane_flow_storage.get_lane_flow_last_step(lane_id)
-                if last_step_flow < 0:
-                    last_step_flow = None
-                predict_lane_flow = self.history_lane_flow[lane_id].predict_one_step(kwargs['current_hour'], avg_flow,
-                                                                                     kwargs['date_type'],
-                                                                                     last_step_flow)
-
-                movement_total_avg_flow += predict_lane_flow
-                self.lane_flow_storage.record_flow(lane_id, avg_flow)
-
+            movement_total_avg_flow = sum(predict_lane_flows[lane_offset:lane_offset + len(lanes_id)])
+            lane_offset += len(lanes_id)
             yield movement, movement_total_avg_flow
 
+    def update_history_online(self, lane_ids: List[int], avg_flows: np.ndarray, date_type: str):
+        """将本时间窗有检测数据的车道流量并入时间窗开始时刻对应的历史时段"""
+        window_start = time.localtime(self.last_update_time)
+        detected = [index for index, lane_id in enumerate(lane_ids) if self.traffic_data_cache.count(lane_id)]
+        if not detected:
+            return None
+        self.history_lane_flow.update_online(window_start.tm_hour * 60 + window_start.tm_min, date_type,
+                                             avg_flows[detected], [lane_ids[index] for index in detected],
+                                             self.online_update_alpha)
+
     def update_all_movement_demand(self, movement_sorted_lanes: Dict[Movement, List[int]], **kwargs):
         for movement, movement_total_avg_flow in self.calculate_movement_avg_flow_stat_predicted(movement_sorted_lanes,
                                                                                                  **kwargs):
@@ -412,12 +432,8 @@ class DynamicIntersectionController(IntersectionController):
             self.last_update_time = detect_start_time
 
         detect_duration = tf_data['cycle_time']
-        for lane_info in tf_data['lanes']:
-            lane_id, volume_hour = lane_volume_retrieve(lane_info, detect_duration)
-            if lane_id not in self.lane_movement_mapping:
-                continue
-
-            self.traffic_data_cache[lane_id].append(volume_hour)
+        # 不在车道映射中的车道由缓存忽略
+        self.traffic_data_cache.store_batch(*lane_volume_arrays(tf_data['lanes'], detect_duration))
 
         if detect_start_time - self.last_update_time >= self.update_interval_sec:
             time.sleep(0.2)
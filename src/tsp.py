@@ -1,112 +1,383 @@
 import numpy as np
-from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
 from warnings import warn
-from typing import List, Tuple, Union, Optional
+from typing import List, Tuple, Optional, Dict, Any, Union, Protocol
 
-from lib.SPAT import Detector
 
+class Detector(Protocol):
+    """QuarterVolumeMat使用的检测器数据字段"""
+    lane: int
+    volume: int
+    queue_length: int
+    detected_period: float
 
-def _inner_variance(lane_volume: np.ndarray):
+
+EXACT_ENGINE = 'exact'  # 动态规划精确求解
+BINSEG_ENGINE = 'binseg'  # 二分分割近似求解
+AUTO_ENGINE = 'auto'  # 按序列长度选择
+AUTO_EXACT_MAX_LENGTH = 96 * 28  # auto模式下精确求解的最大列数(4周的15min数据)
+
+
+def _prefix_tables(lane_volume: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    各车道流量沿时间轴(最后一维)的累积和与平方累积和，首列补零使区间[i, j)可由第j列减第i列得到
+    :param lane_volume: 车道 × 时间的流量矩阵，或日期 × 车道 × 时间的流量张量
+    """
+    volume = np.asarray(lane_volume, dtype=np.float64)
+    volume = volume - volume.mean(axis=-1, keepdims=True)  # 中心化，方差不变且减小累积误差
+    cum_sum = np.zeros(volume.shape[:-1] + (volume.shape[-1] + 1,), dtype=np.float64)
+    cum_sq = np.zeros_like(cum_sum)
+    np.cumsum(volume, axis=-1, out=cum_sum[..., 1:])
+    np.cumsum(volume ** 2, axis=-1, out=cum_sq[..., 1:])
+    return cum_sum, cum_sq
+
+
+def _variance_norm(variance: np.ndarray) -> np.ndarray:
+    """
+    各车道组内方差(倒数第二维)的范数，存在日期维度时对各日求和
+    """
+    norm = np.linalg.norm(variance, axis=-2)
+    return norm.sum(axis=0) if norm.ndim > 1 else norm
+
+
+def _segment_costs_to(cum_sum: np.ndarray, cum_sq: np.ndarray, end: int) -> np.ndarray:
+    """
+    由累积表计算以end结束的全部区间[i, end), i = 0, 1, ..., end-1 的组内方差范数
+    """
+    seg_sum = cum_sum[..., end:end + 1] - cum_sum[..., :end]
+    seg_sq = cum_sq[..., end:end + 1] - cum_sq[..., :end]
+    variance = np.maximum(seg_sq - seg_sum ** 2 / np.arange(end, 0, -1), 0)  # 截断浮点误差产生的负值
+    return _variance_norm(variance)
+
+
+def _fill_partition_column(cost: np.ndarray, start: np.ndarray, end: int, seg_cost: np.ndarray):
+    """
+    动态规划填充第end列：前i列分割为k-1个区间，加上最后一个区间[i, end)
+    :param cost: 最小组内方差和表，原地更新
+    :param start: 最后一个区间的开始下标表，原地更新
+    :param end: 当前填充的列
+    :param seg_cost: 以end结束的全部区间的组内方差范数
+    """
+    cost[0, end] = seg_cost[0]
+    if cost.shape[0] > 1:
+        candidate = cost[:-1, :end] + seg_cost
+        best_start = np.argmin(candidate, axis=1)
+        start[1:, end] = best_start
+        cost[1:, end] = candidate[np.arange(cost.shape[0] - 1), best_start]
+
+
+def _backtrack_spilt(start: np.ndarray, k_partition: int, end: int) -> tuple:
+    """
+    由动态规划的最后区间开始下标表回溯分割点
+    """
+    spilt = []
+    for row in range(k_partition - 1, 0, -1):
+        end = int(start[row, end])
+        spilt.append(end - 1)  # 分割点为前一区间的最后一列
+    return tuple(reversed(spilt))
+
+
+def _segment_costs(cum_sum: np.ndarray, cum_sq: np.ndarray, starts, ends) -> np.ndarray:
+    """
+    由累积表计算一组区间[starts, ends)的组内方差范数
+    """
+    starts, ends = np.broadcast_arrays(starts, ends)
+    seg_sum = cum_sum[..., ends] - cum_sum[..., starts]
+    seg_sq = cum_sq[..., ends] - cum_sq[..., starts]
+    variance = np.maximum(seg_sq - seg_sum ** 2 / (ends - starts), 0)
+    return _variance_norm(variance)
+
+
+def _resolve_engine(engine: str, column_num: int) -> str:
+    if engine == AUTO_ENGINE:
+        return EXACT_ENGINE if column_num <= AUTO_EXACT_MAX_LENGTH else BINSEG_ENGINE
+    if engine not in (EXACT_ENGINE, BINSEG_ENGINE):
+        raise ValueError(f'invalid partition engine {engine}')
+    return engine
+
+
+def _grow_columns(arr: np.ndarray, min_columns: int, fill_value=0) -> np.ndarray:
     """
-    组内方差
+    列容量不足时倍增扩容，使逐列追加的均摊复杂度为O(1)
     """
-    variance = np.var(lane_volume, axis=1) * lane_volume.shape[1]
-    var_norm = np.linalg.norm(variance)
-    return var_norm
+    if arr.shape[1] >= min_columns:
+        return arr
+    grown = np.full((arr.shape[0], max(min_columns, 2 * arr.shape[1])), fill_value, dtype=arr.dtype)
+    grown[:, :arr.shape[1]] = arr
+    return grown
 
 
 class TSP:
     def __init__(self, lane_volume: np.ndarray):
         """
         时间序列分割算法
-        :param lane_volume: 车道流量
+        :param lane_volume: 车道 × 时间的车道流量；为日期 × 车道 × 时间的张量时，区间组内方差范数按日求和，
+            得到对全部日期共同最优的分割
         """
         self.lane_volume = lane_volume
+        self._cum_sum, self._cum_sq = _prefix_tables(lane_volume)
 
-    # 在C++中考虑引入缓存池来记录部分函数调用的结果，起到等价于lru_cache的效果，显著提高运算速度
-    @lru_cache(maxsize=128)
-    def time_series_partition(self, *, k_partition: int, subset_length: Optional[int] = None, start: int = 0) -> Union[np.float32, Tuple[np.float32, tuple]]:
+    def segment_variance(self, start: int, end: int) -> np.ndarray:
         """
-        :param k_partition: 分割区间数量
-        :param subset_length: 数据子集长度，迭代之初可为None，其余时候应为非None
-        :param start: 开始的下标，从0开始计数
-        :return:
+        区间[start, end)内各车道的组内方差(离差平方和)，由累积表O(车道数)得到
+        :param start: 区间开始下标(包含)
+        :param end: 区间结束下标(不包含)
+        :return: 各车道组内方差，输入为张量时为日期 × 车道
+        """
+        seg_sum = self._cum_sum[..., end] - self._cum_sum[..., start]
+        seg_sq = self._cum_sq[..., end] - self._cum_sq[..., start]
+        return np.maximum(seg_sq - seg_sum ** 2 / (end - start), 0)  # 截断浮点误差产生的负值
+
+    def segment_cost(self, start: int, end: int) -> np.float64:
+        """
+        区间[start, end)的组内方差范数，输入为张量时为各日范数之和
+        """
+        return np.linalg.norm(self.segment_variance(start, end), axis=-1).sum()
+
+    def segment_costs_to(self, end: int) -> np.ndarray:
+        """
+        以end结束的全部区间[i, end), i = 0, 1, ..., end-1 的组内方差范数，一次向量化计算
+        """
+        return _segment_costs_to(self._cum_sum, self._cum_sq, end)
+
+    def partition_table(self, max_partition: int, subset_length: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        自底向上的动态规划，逐列填充全部分割区间数量的最优值
+        :param max_partition: 最大分割区间数量
+        :param subset_length: 数据子集长度，None时为全部数据
+        :return: cost[k-1, j]为前j列分割为k个区间的最小组内方差和，start[k-1, j]为对应最后一个区间的开始下标
+        """
+        if subset_length is None:
+            subset_length = self.lane_volume.shape[-1]
+        cost = np.full((max_partition, subset_length + 1), np.inf)  # 0列无法分割，保持为inf
+        start = np.zeros((max_partition, subset_length + 1), dtype=np.int64)
+        for end in range(1, subset_length + 1):
+            _fill_partition_column(cost, start, end, self.segment_costs_to(end))
+        return cost, start
+
+    def _best_bisection(self, start: int, end: int) -> Tuple[np.float64, Optional[int]]:
+        """
+        区间[start, end)内使组内方差和下降最多的一个分割
+        :return: 组内方差和的下降值, 右侧区间的开始下标(区间无法再分时为None)
+        """
+        if end - start < 2:
+            return -np.inf, None
+        candidate = np.arange(start + 1, end)
+        cost = _segment_costs(self._cum_sum, self._cum_sq, start, candidate) + \
+            _segment_costs(self._cum_sum, self._cum_sq, candidate, end)
+        best = int(np.argmin(cost))
+        return self.segment_cost(start, end) - cost[best], int(candidate[best])
+
+    def binary_segmentation(self, max_partition: int, subset_length: int) -> List[Tuple[np.float64, tuple]]:
+        """
+        二分分割的近似求解，每次在下降最多的区间上增加一个分割点，复杂度O(k × n × 车道数)
+        :param max_partition: 最大分割区间数量
+        :param subset_length: 数据子集长度
+        :return: 与all_partitions相同
+        """
+        total_cost = self.segment_cost(0, subset_length)
+        spilt = []
+        partitions = [(total_cost, ())]
+        bisections = {(0, subset_length): self._best_bisection(0, subset_length)}
+        for _ in range(1, max_partition):
+            segment = max(bisections, key=lambda seg: bisections[seg][0])
+            decrease, right_start = bisections.pop(segment)
+            total_cost -= decrease
+            spilt.append(right_start - 1)
+            bisections[(segment[0], right_start)] = self._best_bisection(segment[0], right_start)
+            bisections[(right_start, segment[1])] = self._best_bisection(right_start, segment[1])
+            partitions.append((total_cost, tuple(sorted(spilt))))
+        return partitions
+
+    def all_partitions(self, max_partition: int, subset_length: Optional[int] = None,
+                       engine: str = EXACT_ENGINE) -> List[Tuple[np.float64, tuple]]:
+        """
+        一次求解分割区间数量为1至max_partition的全部最优分割
+        :param max_partition: 最大分割区间数量
+        :param subset_length: 数据子集长度，None时为全部数据
+        :param engine: 求解方式，exact为动态规划精确解，binseg为二分分割近似解，auto按序列长度选择
+        :return: 第k-1个元素为k个区间的(最小组内方差和, 分割点下标)
         """
-        spilt_num = k_partition - 1  # 分割点数量
-        min_var, best_spilt = -1, 0
         if subset_length is None:
-            subset_length = self.lane_volume.shape[1]  # 也是判断函数初始
-        if spilt_num == 0:
-            return _inner_variance(self.lane_volume[:, :subset_length]), ()  # 不划分时直接计算方差
-        elif spilt_num == 1:
-            assert subset_length > 1 and start == 0
-            for i in range(1, subset_length):
-                this_var = _inner_variance(self.lane_volume[:, :i]) + _inner_variance(self.lane_volume[:, i:subset_length])  # 存在至少一个分割点时start必为0
-                if min_var < 0 or this_var < min_var:
-                    min_var, best_spilt = this_var, (start+i-1,)  # 更新最优分割点
-            return min_var, best_spilt  # best_spilt仍然表示分割点的下标(从0开始)
-        else:
-            min_var, last_best_spilt, best_spilt = -1, 0, ()
-            # column_num = lane_volume.shape[1]
-            # 表示第k-1个分割点的可行区间，额外-1因为下标index从0开始
-            for j in range(spilt_num, subset_length):
-                last_var, last2_best_spilt = self.time_series_partition(k_partition=k_partition-1, subset_length=j)
-                this_var = last_var + _inner_variance(self.lane_volume[:, j: subset_length])
-                if min_var < 0 or this_var < min_var:
-                    min_var, last_best_spilt, best_spilt = this_var, j-1, last2_best_spilt + (j-1,)  # 更新最优分割点
-            return min_var, best_spilt
+            subset_length = self.lane_volume.shape[-1]
+        if not 0 < max_partition <= subset_length:
+            raise ValueError(f'cannot split {subset_length} columns into {max_partition} partitions')
+        if _resolve_engine(engine, subset_length) == BINSEG_ENGINE:
+            return self.binary_segmentation(max_partition, subset_length)
+        cost, start = self.partition_table(max_partition, subset_length)
+        return [(cost[k - 1, subset_length], _backtrack_spilt(start, k, subset_length))
+                for k in range(1, max_partition + 1)]
+
+    def time_series_partition(self, *, k_partition: int, subset_length: Optional[int] = None,
+                              engine: str = EXACT_ENGINE) -> Tuple[np.float64, tuple]:
+        """
+        :param k_partition: 分割区间数量
+        :param subset_length: 数据子集长度，None时为全部数据
+        :param engine: 求解方式，见all_partitions
+        :return: 最小组内方差和, 分割点下标(从0开始，表示该列为前一区间的最后一列)
+        """
+        return self.all_partitions(k_partition, subset_length, engine)[-1]
+
+
+class OnlineTSP:
+    def __init__(self, lane_num: int, max_partition: int = 10, capacity: int = 96):
+        """
+        在线时间序列分割算法，保留动态规划状态，每追加一列只需计算以该列结束的区间
+        :param lane_num: 车道数量
+        :param max_partition: 最大分割区间数，额外保留一行用于计算拐点
+        :param capacity: 初始列容量，默认为一天的15min数量，不足时倍增扩容
+        """
+        self.lane_num = lane_num
+        self.max_partition = max_partition
+        self.column_num = 0
+        self._offset = None  # 以首列为基准平移数据，减小累积误差
+        self._cum_sum = np.zeros((lane_num, capacity + 1), dtype=np.float64)
+        self._cum_sq = np.zeros((lane_num, capacity + 1), dtype=np.float64)
+        self._cost = np.full((max_partition + 1, capacity + 1), np.inf)
+        self._start = np.zeros((max_partition + 1, capacity + 1), dtype=np.int64)
+
+    def append_column(self, column: np.ndarray):
+        """
+        追加一列车道流量并扩展动态规划状态，复杂度O(k × n × 车道数)
+        :param column: 各车道流量
+        """
+        column = np.asarray(column, dtype=np.float64).reshape(self.lane_num)
+        if self._offset is None:
+            self._offset = column.copy()
+        end = self.column_num + 1
+        if end >= self._cost.shape[1]:
+            self._cum_sum = _grow_columns(self._cum_sum, end + 1)
+            self._cum_sq = _grow_columns(self._cum_sq, end + 1)
+            self._cost = _grow_columns(self._cost, end + 1, fill_value=np.inf)
+            self._start = _grow_columns(self._start, end + 1)
+        shifted = column - self._offset
+        self._cum_sum[:, end] = self._cum_sum[:, end - 1] + shifted
+        self._cum_sq[:, end] = self._cum_sq[:, end - 1] + shifted ** 2
+        _fill_partition_column(self._cost, self._start, end, _segment_costs_to(self._cum_sum, self._cum_sq, end))
+        self.column_num = end
+
+    def extend(self, lane_volume: np.ndarray):
+        for column in np.asarray(lane_volume).T:
+            self.append_column(column)
+
+    def all_partitions(self, max_partition: Optional[int] = None) -> List[Tuple[np.float64, tuple]]:
+        """
+        当前数据下分割区间数量为1至max_partition的全部最优分割
+        :param max_partition: 最大分割区间数量，None时为当前可求解的最大值
+        :return: 第k-1个元素为k个区间的(最小组内方差和, 分割点下标)
+        """
+        limit = min(self._cost.shape[0], self.column_num)
+        if max_partition is None:
+            max_partition = min(self.max_partition, limit)
+        if not 0 < max_partition <= limit:
+            raise ValueError(f'cannot split {self.column_num} columns into {max_partition} partitions')
+        end = self.column_num
+        return [(self._cost[k - 1, end], _backtrack_spilt(self._start, k, end)) for k in range(1, max_partition + 1)]
+
+    def time_series_partition(self, *, k_partition: int) -> Tuple[np.float64, tuple]:
+        return self.all_partitions(k_partition)[-1]
+
+    def partition_curve(self) -> 'PartitionCurve':
+        """
+        当前数据下的组内方差和-区间数量曲线及拐点区间数量，与partition_curve结果一致
+        """
+        if self.column_num < 2:
+            raise ValueError('at least 2 columns are required for time series partition')
+        max_partition = min(self.max_partition, self.column_num - 1)
+        return _curve_from_partitions(self.all_partitions(max_partition + 1))
+
+
+class ColumnBuffer:
+    def __init__(self, row_num: int, dtype=np.float32, capacity: int = 96):
+        """
+        预分配的按列追加数组，容量不足时倍增扩容，读取为零拷贝视图
+        :param row_num: 行数量
+        :param dtype: 数据类型
+        :param capacity: 初始列容量
+        """
+        self._data = np.zeros((row_num, capacity), dtype=dtype)
+        self.size = 0
+
+    def append(self, column: np.ndarray):
+        if self.size == self._data.shape[1]:
+            self._data = _grow_columns(self._data, self.size + 1)
+        self._data[:, self.size] = column
+        self.size += 1
+
+    def clear(self):
+        self.size = 0  # 保留已分配空间
+
+    @property
+    def view(self) -> Optional[np.ndarray]:
+        """
+        已存储数据的视图，无数据时为None
+        """
+        return self._data[:, :self.size] if self.size else None
+
+    @property
+    def last_column(self) -> np.ndarray:
+        return self._data[:, self.size - 1]
 
 
 class QuarterVolumeMat:
-    def __init__(self, lanes: List[str]):
+    def __init__(self, lanes: List[int], partition_solver: Optional[OnlineTSP] = None, capacity: int = 96):
+        """
+        :param lanes: 涉及的车道id
+        :param partition_solver: 在线时间序列分割求解器，非None时每生成一列15min流量即同步更新分割结果
+        :param capacity: 15min数据的初始列容量，默认为一天
+        """
         self.local_time = -1
         self.lanes = lanes  # 涉及的车道id
         self.lane_num = len(lanes)
-        self.lane_volume = None  # 车道流量数据
-        self.__volume_cache = None  # np.array([[] for _ in range(self.lane_num)], dtype=np.float32)  # 累积流量存储
-        self.lane_queue = None #车道排队长度数据
-        self.__queue_cache = None #累积排队长度存储
+        self._lane_index = {lane: index for index, lane in enumerate(lanes)}  # 车道id对应的行
+        self._lane_volume = ColumnBuffer(self.lane_num, np.float32, capacity)  # 车道流量数据
+        self.__volume_cache = ColumnBuffer(self.lane_num, np.float32)  # 累积流量存储
+        self._lane_queue = ColumnBuffer(self.lane_num, np.float64, capacity)  # 车道排队长度数据
+        self.__queue_cache = ColumnBuffer(self.lane_num, np.int32)  # 累积排队长度存储
         self.__last_mat_update = -1
+        self.partition_solver = partition_solver
+
+    @property
+    def lane_volume(self) -> Optional[np.ndarray]:
+        return self._lane_volume.view
+
+    @property
+    def lane_queue(self) -> Optional[np.ndarray]:
+        return self._lane_queue.view
 
-        
     def append_queue(self, timestamp: int, detector_data: List[Detector]):
         assert timestamp > self.local_time
         if self.__last_mat_update < 0:
             self.__last_mat_update = timestamp  # 累积排队长度开始计时点
-        new_column = np.zeros([self.lane_num, 1], dtype=np.int32)
+        new_column = np.zeros(self.lane_num, dtype=np.int32)
         period = 0
         lane_counter = set()
         for detector in detector_data:
-            try:
-                new_column[self.lanes.index(detector.lane)] = detector.queue_length
-                lane_counter.add(detector.lane)
-                if not period:
-                    period = detector.detected_period
-            except ValueError:
+            lane_index = self._lane_index.get(detector.lane)
+            if lane_index is None:
                 warn(f'{detector.lane} is not in current volume matrix')
+                continue
+            new_column[lane_index] = detector.queue_length
+            lane_counter.add(detector.lane)
+            if not period:
+                period = detector.detected_period
         # 判断是否有缺少的车道数据，有则用上次历史数据代替
         missing_lane = lane_counter.difference(self.lanes)
         if missing_lane:
             for m_lane in missing_lane:
                 # 确保有历史数据
                 if self.__queue_cache.size > 0:
-                    insert_index = self.lanes.index(m_lane)
-                    new_column[insert_index] = self.__queue_cache[insert_index, -1]
-        if self.__queue_cache is None:
-            self.__queue_cache = new_column
-        else:
-            self.__queue_cache = np.concatenate((self.__queue_cache, new_column), axis=1)
+                    insert_index = self._lane_index[m_lane]
+                    new_column[insert_index] = self.__queue_cache.last_column[insert_index]
+        self.__queue_cache.append(new_column)
         time_counter = timestamp + period - self.__last_mat_update
         if time_counter >=60 * 15:
-            quarter_queue = np.mean(self.__queue_cache, axis=1) / time_counter * 900 #?
-            quarter_queue = quarter_queue.reshape(-1, 1)
-            # print(self.lane_queue)
-            if self.lane_queue is None:
-                self.lane_queue = quarter_queue
-            else:
-                self.lane_queue = np.concatenate((self.lane_queue, quarter_queue), axis=1)
+            quarter_queue = np.mean(self.__queue_cache.view, axis=1) / time_counter * 900 #?
+            self._lane_queue.append(quarter_queue)
             self.__last_mat_update = -1
-            self.__queue_cache = None
+            self.__queue_cache.clear()
         self.local_time = timestamp
 
 
@@ -114,68 +385,156 @@ class QuarterVolumeMat:
         assert timestamp > self.local_time
         if self.__last_mat_update < 0:
             self.__last_mat_update = timestamp  # 累积流量开始计时点
-        new_column = np.zeros([self.lane_num, 1], dtype=np.float32)
+        new_column = np.zeros(self.lane_num, dtype=np.float32)
         period = 0
         lane_counter = set()
         for detector in detector_data:
-            try:
-                new_column[self.lanes.index(detector.lane)] = detector.volume
-                lane_counter.add(detector.lane)
-                if not period:
-                    period = detector.detected_period
-            except ValueError:
+            lane_index = self._lane_index.get(detector.lane)
+            if lane_index is None:
                 warn(f'{detector.lane} is not in current volume matrix')
+                continue
+            new_column[lane_index] = detector.volume
+            lane_counter.add(detector.lane)
+            if not period:
+                period = detector.detected_period
         # 判断是否有缺少的车道数据，有则用上次历史数据代替
         missing_lane = lane_counter.difference(self.lanes)
         if missing_lane:
             for m_lane in missing_lane:
                 # 确保有历史数据
                 if self.__volume_cache.size > 0:
-                    insert_index = self.lanes.index(m_lane)
-                    new_column[insert_index] = self.__volume_cache[insert_index, -1]  # 上一次的历史数据代替
-        if self.__volume_cache is None:
-            self.__volume_cache = new_column
-        else:
-            self.__volume_cache = np.concatenate((self.__volume_cache, new_column), axis=1)  # 合并添加到缓存中
+                    insert_index = self._lane_index[m_lane]
+                    new_column[insert_index] = self.__volume_cache.last_column[insert_index]  # 上一次的历史数据代替
+        self.__volume_cache.append(new_column)  # 添加到缓存中
         time_counter = timestamp + period - self.__last_mat_update
         if time_counter >= 60 * 15:
-            quarter_vol = np.sum(self.__volume_cache, axis=1) / time_counter * 900  # 转换为pcu/quarter
-            quarter_vol = quarter_vol.reshape(-1, 1)
-            # print(self.lane_volume)
-            if self.lane_volume is None:
-                self.lane_volume = quarter_vol
-            else:
-                self.lane_volume = np.concatenate((self.lane_volume, quarter_vol), axis=1)
+            quarter_vol = np.sum(self.__volume_cache.view, axis=1) / time_counter * 900  # 转换为pcu/quarter
+            self._lane_volume.append(quarter_vol)
+            if self.partition_solver is not None:
+                self.partition_solver.append_column(quarter_vol)
             self.__last_mat_update = -1  # 清空计时
-            self.__volume_cache = None
+            self.__volume_cache.clear()
         self.local_time = timestamp
 
 
-def partition_acceleration(lane_volume: np.ndarray, max_partition=10):
+@dataclass
+class PartitionCurve:
+    costs: np.ndarray  # costs[k-1]为k个区间的最小组内方差和，k = 1, ..., max_partition+1
+    spilts: List[tuple]  # spilts[k-1]为k个区间的最优分割点下标
+    best_k: int  # 二阶差分拐点确定的分割区间数量
+
+    @property
+    def acceleration(self) -> np.ndarray:
+        """
+        组内方差和曲线的二阶差分，第i个元素对应k = i+2
+        """
+        return np.diff(self.costs, n=2)
+
+    @property
+    def best_spilt(self) -> tuple:
+        return self.spilts[self.best_k - 1]
+
+
+def _elbow_partition_num(costs: np.ndarray) -> int:
     """
-    考虑边际递减效应的时间序列分割点算法，应使用该方法
+    二阶差分小于k=2处的二阶差分时认为边际收益开始递减，返回此前的区间数量
+    :param costs: costs[k-1]为k个区间的最小组内方差和，长度为max_partition+1
+    """
+    max_partition = len(costs) - 1
+    first_acceleration = None
+    for k in range(2, max_partition + 1):
+        acceleration = costs[k] - 2 * costs[k - 1] + costs[k - 2]  # second difference
+        if first_acceleration is None:
+            first_acceleration = acceleration
+        elif acceleration < first_acceleration:
+            return k - 1
+    return max_partition
+
+
+def _curve_from_partitions(partitions: List[Tuple[np.float64, tuple]]) -> PartitionCurve:
+    costs = np.array([var for var, _ in partitions])
+    spilts = [spilt for _, spilt in partitions]
+    return PartitionCurve(costs, spilts, _elbow_partition_num(costs))
+
+
+def partition_curve(lane_volume: np.ndarray, max_partition=10, engine: str = EXACT_ENGINE) -> PartitionCurve:
+    """
+    一次求解得到完整的组内方差和-区间数量曲线，以及拐点确定的分割区间数量
     :param lane_volume: 车道流量数据
     :param max_partition: 最大分割区间数
+    :param engine: 求解方式，exact为动态规划精确解，binseg为二分分割近似解，auto按序列长度选择
     :return:
     """
-    k = 2
-    solver = TSP(lane_volume)
-    this_var, this_spilt = solver.time_series_partition(k_partition=k)
-    last_var, last_spilt = solver.time_series_partition(k_partition=1)
-    last_acceleration = None
-    while True:
-        if k == max_partition + 1:
-            return k - 1, last_spilt
-        next_var, next_spilt = solver.time_series_partition(k_partition=k+1)
-        acceleration = next_var - 2 * this_var + last_var  # second difference
-        if last_acceleration is not None:
-            if acceleration < last_acceleration:
-                return k - 1, last_spilt
-        else:
-            last_acceleration = acceleration
-        last_var, last_spilt = this_var, this_spilt  # 不需要重复计算
-        this_var, this_spilt = next_var, next_spilt
-        k += 1
+    column_num = lane_volume.shape[-1]
+    if column_num < 2:
+        raise ValueError('at least 2 columns are required for time series partition')
+    max_partition = min(max_partition, column_num - 1)  # 计算二阶差分需要额外求解max_partition+1个区间
+    return _curve_from_partitions(TSP(lane_volume).all_partitions(max_partition + 1, engine=engine))
+
+
+def partition_acceleration(lane_volume: np.ndarray, max_partition=10, engine: str = EXACT_ENGINE):
+    """
+    考虑边际递减效应的时间序列分割点算法，应使用该方法
+    :param lane_volume: 车道流量数据
+    :param max_partition: 最大分割区间数
+    :param engine: 求解方式，长序列可使用binseg或auto
+    :return: 分割区间数量, 分割点下标
+    """
+    curve = partition_curve(lane_volume, max_partition, engine)
+    return curve.best_k, curve.best_spilt
+
+
+def _shared_partition_acceleration(shm_name: str, offset: int, shape: Tuple[int, ...], max_partition: int,
+                                   engine: str) -> Tuple[int, tuple]:
+    """
+    进程池任务：从共享内存读取车道流量并求解分割
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        lane_volume = np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=offset)
+        result = partition_acceleration(lane_volume, max_partition, engine)
+        del lane_volume  # 关闭共享内存前需释放对缓冲区的引用
+        return result
+    finally:
+        shm.close()
+
+
+def batch_partition(lane_volumes: Union[np.ndarray, Dict[Any, np.ndarray]], max_partition=10,
+                    engine: str = EXACT_ENGINE, max_workers: Optional[int] = None) -> Union[List[Tuple[int, tuple]],
+                                                                                        Dict[Any, Tuple[int, tuple]]]:
+    """
+    多日/多交叉口的批量分割，输入写入共享内存后由进程池并行求解
+    :param lane_volumes: 日期 × 车道 × 15min的流量数组(每日单独分割，多日共同分割应直接使用partition_acceleration)，
+        或交叉口id为键的车道流量字典
+    :param max_partition: 最大分割区间数
+    :param engine: 求解方式，见partition_acceleration
+    :param max_workers: 进程数量，None时为CPU数量
+    :return: 与输入顺序对应的(分割区间数量, 分割点下标)列表，输入为字典时返回相同键的字典
+    """
+    if isinstance(lane_volumes, dict):
+        keys = list(lane_volumes.keys())
+        matrices = [np.asarray(lane_volumes[key], dtype=np.float64) for key in keys]
+    else:
+        keys = None
+        matrices = list(np.asarray(lane_volumes, dtype=np.float64))
+    if not matrices:
+        return {} if keys is not None else []
+
+    offsets = np.cumsum([0] + [matrix.nbytes for matrix in matrices])
+    shm = shared_memory.SharedMemory(create=True, size=int(offsets[-1]))
+    try:
+        for matrix, offset in zip(matrices, offsets):
+            np.ndarray(matrix.shape, dtype=np.float64, buffer=shm.buf, offset=offset)[:] = matrix
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_shared_partition_acceleration, shm.name, int(offset), matrix.shape,
+                                       max_partition, engine) for matrix, offset in zip(matrices, offsets)]
+            results = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+    if keys is not None:
+        return dict(zip(keys, results))
+    return results
 
 
 if __name__ == '__main__':
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# @Time        : 2026/10/17 21:10
+# @File        : backtest.py
+# @Description : 历史流量预测(predict_one_step)的批量回测与参数扫描，在项目根目录下运行 python -m utils.backtest
+import argparse
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from utils.data_load import (MultiLaneHistoryFlow, PREDICT_RESTRICT_WEIGHT, QUANTILE_BIN_WIDTH, build_history_store,
+                             date_type_of, predict_from_history)
+
+DEFAULT_DATE_CLASS = {'weekdays': [4, 6, 7, 10, 11, 12], 'weekends': [8, 9], 'festivals': [5]}
+DEFAULT_LANES = (16, 17, 18, 19, 30, 31, 32, 33)
+DEFAULT_RESTRICT_DIFFS = (50, 100, 200, 400)
+DEFAULT_RESTRICT_WEIGHTS = (0.5, 0.7, 0.9)
+
+
+@dataclass
+class BacktestReport:
+    date_types: List[str]
+    lane_ids: List[int]
+    mae: np.ndarray  # [日期类型, 车道, 预测时段]，无样本为nan
+    rmse: np.ndarray
+    mape: np.ndarray  # 百分比，实测流量为0的样本不计入
+    count: np.ndarray
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """各日期类型及全部样本的总体误差"""
+        summary = {}
+        groups = [(d_type, (type_index,)) for type_index, d_type in enumerate(self.date_types)]
+        groups.append(('all', tuple(range(len(self.date_types)))))
+        for name, type_indices in groups:
+            count = self.count[list(type_indices)]
+            total = int(count.sum())
+            if not total:
+                summary[name] = {'count': 0, 'mae': None, 'rmse': None, 'mape': None}
+                continue
+            valid = count > 0
+            mae = self.mae[list(type_indices)][valid]
+            rmse = self.rmse[list(type_indices)][valid]
+            mape = self.mape[list(type_indices)][valid]
+            weight = count[valid]
+            mape_valid = ~np.isnan(mape)
+            summary[name] = {
+                'count': total,
+                'mae': float((mae * weight).sum() / total),
+                'rmse': float(np.sqrt((rmse ** 2 * weight).sum() / total)),
+                'mape': float((mape[mape_valid] * weight[mape_valid]).sum() / weight[mape_valid].sum())
+                if mape_valid.any() else None,
+            }
+        return summary
+
+
+@dataclass
+class BacktestData:
+    model: MultiLaneHistoryFlow  # 逐日留一的历史流量，第i个日期类型为第i个日期所属类型扣除该日后的历史流量
+    date_ordinals: np.ndarray
+    observed: np.ndarray  # [日期, 车道, 时段]实测流量，无数据为nan
+    day_type_index: np.ndarray  # 各日期在date_types中的下标
+    date_types: List[str]
+
+
+def day_type_indices(date_ordinals: np.ndarray, date_class: Dict[Any, List[Union[int, date]]]) -> np.ndarray:
+    type_lookup = {d_type: index for index, d_type in enumerate(date_class)}
+    return np.array([type_lookup[date_type_of(date_class, date.fromordinal(ordinal))]
+                     for ordinal in date_ordinals.tolist()], dtype=np.int64)
+
+
+def one_step_predictions(model: MultiLaneHistoryFlow, observed: np.ndarray, model_index: np.ndarray,
+                         restrict_diff: float = 200, restrict_weight: float = PREDICT_RESTRICT_WEIGHT,
+                         quantile: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    对每日每个时段按控制器的方式进行一步预测：时段s结束时以时段s的实测流量和时段s-1的流量预测时段s+1
+    :param observed: [日期, 车道, 时段]实测流量，无数据为nan
+    :param model_index: 各日期使用的model日期类型下标
+    :return: [日期, 车道, 时段]的预测流量与对应的实测流量，时段0及历史流量为nan的时段没有预测，为nan
+    """
+    split_num = observed.shape[-1]
+    # 时段s的预测发生在时段s结束时
+    current_hours = np.arange(1, split_num) * model.split_interval
+    tod_flow = model.quantile_flow(quantile) if quantile is not None else None
+    history_next, history_current, history_last = (
+        model.window_flow_table(current_hours, backward_num, tod_flow)[model_index] for backward_num in (0, 1, 2))
+    history_next_diff = history_next - history_current
+    history_diff = history_current - history_last
+    current_flow = observed[..., :-1]
+    # 每日首个时段没有上一时间步
+    last_step_flow = np.concatenate([np.full(observed.shape[:-1] + (1,), np.nan), observed[..., :-2]], axis=-1)
+    predict = np.full(observed.shape, np.nan)
+    predict[..., 1:] = predict_from_history(current_flow, last_step_flow, history_next, history_next_diff,
+                                            history_diff, restrict_diff, restrict_weight)
+    predict[..., 1:][np.isnan(history_next + history_current + history_last)] = np.nan
+    return predict, observed
+
+
+def backtest(data: BacktestData, restrict_diff: float = 200, restrict_weight: float = PREDICT_RESTRICT_WEIGHT,
+             quantile: Optional[float] = None) -> BacktestReport:
+    """以逐日留一的历史流量进行一步预测，按日期类型、车道、时段统计MAE/RMSE/MAPE"""
+    model, day_type_index = data.model, data.day_type_index
+    predict, target = one_step_predictions(model, data.observed, np.arange(len(data.observed)), restrict_diff,
+                                           restrict_weight, quantile)
+    valid = ~np.isnan(predict) & ~np.isnan(target)
+    error = np.where(valid, predict - target, 0.)
+    percentage_valid = valid & (target > 0)
+    percentage_error = np.divide(np.abs(error), target, out=np.zeros_like(error), where=percentage_valid)
+
+    shape = (len(data.date_types),) + model.tod_flow.shape[1:]
+    sums = {name: np.zeros(shape) for name in ('abs', 'square', 'percentage', 'count', 'percentage_count')}
+    np.add.at(sums['abs'], day_type_index, np.abs(error))
+    np.add.at(sums['square'], day_type_index, error ** 2)
+    np.add.at(sums['percentage'], day_type_index, percentage_error)
+    np.add.at(sums['count'], day_type_index, valid)
+    np.add.at(sums['percentage_count'], day_type_index, percentage_valid)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return BacktestReport(
+            date_types=list(data.date_types),
+            lane_ids=list(model.lane_ids),
+            mae=sums['abs'] / sums['count'],
+            rmse=np.sqrt(sums['square'] / sums['count']),
+            mape=sums['percentage'] / sums['percentage_count'] * 100,
+            count=sums['count'].astype(np.int64),
+        )
+
+
+def load_backtest_data(mature_data_dir_path: str, date_class: Dict[Any, List[Union[int, date]]],
+                       split_interval_hour: float, lane_ids: Sequence[int], window_days: Optional[int] = None,
+                       quantiles: Sequence[float] = (), quantile_bin_width: float = QUANTILE_BIN_WIDTH
+                       ) -> BacktestData:
+    """
+    读取历史数据，返回回测使用的逐日数据，每个日期的历史流量均由其余日期建立，避免以被预测的日期建模
+    :param quantiles: 回测中作为历史流量的分位数，需预先计算
+    """
+    store = build_history_store(mature_data_dir_path, split_interval_hour, list(lane_ids), window_days,
+                                quantile_bin_width if quantiles else None, date_class=date_class,
+                                keep_day_bins=bool(quantiles))
+    date_ordinals, observed = store.daily_flow()
+    _, model = store.leave_one_out_flow(date_class, quantiles)
+    return BacktestData(model, date_ordinals, observed, day_type_indices(date_ordinals, date_class), list(date_class))
+
+
+_sweep_data: Optional[BacktestData] = None
+
+
+def _init_sweep_worker(data: BacktestData):
+    global _sweep_data
+    _sweep_data = data
+
+
+def _sweep_task(params: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    return backtest(_sweep_data, **params).summary()
+
+
+def parameter_sweep(data: BacktestData, param_grid: Dict[str, Sequence[Any]], max_workers: Optional[int] = None) -> List[dict]:
+    """
+    在进程池中对参数网格的每个组合进行回测，数据在各进程初始化时传入一次
+    :param param_grid: backtest的参数名为键，候选值为值，如{'restrict_diff': [100, 200], 'quantile': [None, 0.5]}
+    :return: 各参数组合及其总体误差
+    """
+    param_names = list(param_grid)
+    combinations = [dict(zip(param_names, values)) for values in itertools.product(*param_grid.values())]
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_sweep_worker,
+                             initargs=(data,)) as executor:
+        summaries = list(executor.map(_sweep_task, combinations))
+    return [{'params': params, 'summary': summary} for params, summary in zip(combinations, summaries)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='backtest of history flow one step prediction')
+    parser.add_argument('--history-dir', default='data/history')
+    parser.add_argument('--date-class', type=json.loads, default=DEFAULT_DATE_CLASS,
+                        help='json mapping of date type to days of month')
+    parser.add_argument('--split-interval', type=float, default=1)
+    parser.add_argument('--lanes', type=int, nargs='+', default=list(DEFAULT_LANES))
+    parser.add_argument('--window-days', type=int, default=None)
+    parser.add_argument('--restrict-diffs', type=float, nargs='+', default=list(DEFAULT_RESTRICT_DIFFS))
+    parser.add_argument('--restrict-weights', type=float, nargs='+', default=list(DEFAULT_RESTRICT_WEIGHTS))
+    parser.add_argument('--quantiles', type=float, nargs='*', default=[],
+                        help='history baselines to sweep besides the mean')
+    parser.add_argument('--quantile-bin-width', type=float, default=QUANTILE_BIN_WIDTH)
+    parser.add_argument('--max-workers', type=int, default=None)
+    parser.add_argument('--output', default='backtest.json')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    data = load_backtest_data(args.history_dir, args.date_class, args.split_interval, args.lanes, args.window_days,
+                              args.quantiles, args.quantile_bin_width)
+    param_grid = {'restrict_diff': args.restrict_diffs, 'restrict_weight': args.restrict_weights,
+                  'quantile': [None] + args.quantiles}
+    results = parameter_sweep(data, param_grid, args.max_workers)
+    results.sort(key=lambda record: record['summary']['all']['mae'] or np.inf)
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'days': len(data.date_ordinals),
+        'lanes': args.lanes,
+        'elapsed_sec': time.perf_counter() - start_time,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    best = results[0]
+    print(f'{len(results)} parameter sets over {len(data.date_ordinals)} days in {report["elapsed_sec"]:.2f}s, '
+          f'best {best["params"]} mae {best["summary"]["all"]["mae"]}, report written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,25 +4,36 @@
 # @Description :
 
 import csv
+import hashlib
+import json
 import os
-from datetime import datetime
-from typing import Tuple, List, Dict, Optional
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Tuple, List, Dict, Optional, Any, Sequence, Union
 
-from src.lane_change import lane_volume_retrieve
-from utils.process import read_file
+from lib.state import LaneAccumulator
+from lib.tool import logger
+from src.lane_change import lane_volume_arrays
+from utils.log_cache import read_file_cached
+from utils.log_index import read_file_range
+from utils.process import read_file, read_file_parallel, LogReader, compression_suffix, is_log_file, log_base_name
 
 
 class AccumulateCache:
     def __init__(self, lane_ids: List[int], accumulate_interval_sec: float):
-        self._cache: Dict[int, List[float]] = {lane_id: [] for lane_id in lane_ids}
+        self._cache = LaneAccumulator(lane_ids)
         self.last_update_time = None
         self.interval = accumulate_interval_sec
 
     def store_data(self, lane_id: int, volume_hour: float):
-        storage = self._cache.get(lane_id)
-        if storage is None:
-            return
-        storage.append(volume_hour)
+        self._cache.store(lane_id, volume_hour)
+
+    def store_batch(self, lane_ids: Sequence[int], volume_hours: Sequence[float]):
+        self._cache.store_batch(lane_ids, volume_hours)
+
+    def store_lanes(self, lanes: List[dict], stat_duration_sec: float):
+        """存储一条统计记录中全部车道的流量"""
+        self._cache.store_batch(*lane_volume_arrays(lanes, stat_duration_sec))
 
     def pop_data_query(self, current_time: float) -> Tuple[Optional[Dict[str, float]], float]:
         if self.last_update_time is None:
@@ -31,63 +42,255 @@ class AccumulateCache:
         if current_time >= self.last_update_time + self.interval:
             tmp_last_update_time = self.last_update_time
             self.last_update_time = current_time
-            avg_stat = {'lane' + str(lane_id): round(sum(stat) / len(stat)) if len(stat) else 0 for lane_id, stat in
-                        self._cache.items()}
-            for stat in self._cache.values():
-                stat.clear()
+            avg_stat = {'lane' + str(lane_id): round(avg_flow) for lane_id, avg_flow in
+                        zip(self._cache.lanes, self._cache.means().tolist())}
+            self._cache.clear()
             return avg_stat, tmp_last_update_time
 
         return None, self.last_update_time
 
+    def push(self, current_time: float, lane_ids: Sequence[int], volume_hours: Sequence[float]) -> Optional[dict]:
+        """
+        存储一条记录的车道流量，时间窗结束时返回该时间窗的汇总记录(包含start、end)
+        """
+        self.store_batch(lane_ids, volume_hours)
+        record_data, last_update_time = self.pop_data_query(current_time)
+        if record_data is not None:
+            record_data.update({'start': last_update_time, 'end': current_time})
+        return record_data
+
+    def state(self) -> dict:
+        """未结束的累积时间窗状态，用于增量处理时断点续算"""
+        return {'last_update_time': self.last_update_time, 'interval': self.interval, 'cache': self._cache.state()}
+
+    def load_state(self, state: dict):
+        if state['interval'] != self.interval:
+            raise ValueError(f'accumulate interval {state["interval"]} in state mismatch {self.interval}')
+        self.last_update_time = state['last_update_time']
+        self._cache.load_state(state['cache'])
+
+
+LOCAL_EPOCH = datetime(1970, 1, 1)  # 本地时间的时间窗序号起点
+
+
+class AlignedAccumulateCache:
+    def __init__(self, lane_ids: List[int], accumulate_interval_sec: float):
+        """
+        按本地时间对齐的固定时间窗汇总车道流量，记录按floor(本地时间 / 时间窗长度)归入时间窗，
+        日粒度的时间窗从本地零点开始
+        """
+        self._cache = LaneAccumulator(lane_ids)
+        self.interval = accumulate_interval_sec
+        self.bucket: Optional[int] = None  # 当前时间窗的序号
+
+    def _local_bucket(self, current_time: float) -> int:
+        local_time = datetime.fromtimestamp(current_time)
+        local_seconds = (local_time - LOCAL_EPOCH).total_seconds()
+        return int(local_seconds // self.interval)
+
+    def _bucket_timestamp(self, bucket: int) -> float:
+        """时间窗在本地时间下的开始时刻对应的时间戳"""
+        return (LOCAL_EPOCH + timedelta(seconds=bucket * self.interval)).timestamp()
+
+    def push(self, current_time: float, lane_ids: Sequence[int], volume_hours: Sequence[float]) -> Optional[dict]:
+        """
+        存储一条记录的车道流量，记录进入新的时间窗时返回上一个时间窗的汇总记录
+        """
+        bucket = self._local_bucket(current_time)
+        record_data = None
+        if self.bucket is not None and bucket != self.bucket:
+            record_data = {'lane' + str(lane_id): round(avg_flow) for lane_id, avg_flow in
+                           zip(self._cache.lanes, self._cache.means().tolist())}
+            record_data.update({'start': int(self._bucket_timestamp(self.bucket)),
+                                'end': int(self._bucket_timestamp(self.bucket + 1))})
+            self._cache.clear()
+        self.bucket = bucket
+        self._cache.store_batch(lane_ids, volume_hours)
+        return record_data
+
+
+ROLLUP_MINUTES = (5, 15, 60, 1440)  # 多粒度汇总的默认时间间隔(min)
+CHECKPOINT_FILE = 'history_checkpoint.json'  # 增量处理的断点记录，存放在日志目录下
+CHECKPOINT_HEAD_BYTES = 1024  # 以日志开头的字节识别日志是否被替换
+
+
+def rollup_dir_name(interval_minute: int) -> str:
+    return f'history_{interval_minute}min'
+
+
+def _log_reader(parallel: bool, use_cache: bool, date_start: Optional[datetime] = None,
+                date_end: Optional[datetime] = None):
+    if use_cache:
+        return partial(read_file_cached, parallel=parallel)
+    if parallel:
+        return read_file_parallel
+    if date_start is not None or date_end is not None:
+        return partial(read_file_range, time_start=date_start, time_end=date_end)  # 由时间索引直接定位
+    return read_file
+
+
+def _accumulate_log(f_path: str, reader, caches: Dict[Any, Union[AccumulateCache, AlignedAccumulateCache]],
+                    date_start: Optional[datetime] = None, date_end: Optional[datetime] = None) -> Dict[Any, List[dict]]:
+    """
+    单次读取日志，同时按多个累积缓存的时间间隔汇总车道流量
+    :return: 与caches相同键的汇总记录
+    """
+    dumped_data = {key: [] for key in caches}
+    start_ts = date_start.timestamp() if date_start is not None else None
+    end_ts = date_end.timestamp() if date_end is not None else None
+    for tf_data in reader(f_path):
+        tf_data = tf_data[0]
+        detect_start_time = tf_data['cycle_start_time']
+        if start_ts is not None and detect_start_time < start_ts or \
+                end_ts is not None and detect_start_time >= end_ts:
+            continue
+
+        detect_duration = tf_data['cycle_time']
+        lane_ids, volume_hours = lane_volume_arrays(tf_data['lanes'], detect_duration)
+        for key, cache in caches.items():
+            record_data = cache.push(detect_start_time, lane_ids, volume_hours)
+            if record_data is not None:
+                dumped_data[key].append(record_data)
+    return dumped_data
+
+
+def _store_accumulated_data(dumped_data: List[dict], f_name: str, data_dir_path: str, saved_dir_name: str = 'history',
+                            append: bool = False):
+    if not dumped_data:
+        return
+    field_names = ['start', 'end']
+    field_names.extend(sorted(item for item in dumped_data[0].keys() if item.startswith('lane')))
+    store_date_data(dumped_data, f_name, data_dir_path, field_names, saved_dir_name, append)
+
+
+def _load_checkpoint(checkpoint_path: str) -> Dict[str, dict]:
+    if not os.path.exists(checkpoint_path):
+        return {}
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _dump_checkpoint(checkpoint: Dict[str, dict], checkpoint_path: str):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)  # 原子替换，避免中断时断点文件损坏
+
+
+def _file_identity(f_path: str, head_size: int = CHECKPOINT_HEAD_BYTES) -> dict:
+    """日志文件的inode与开头head_size字节的摘要，日志轮转或被替换时发生变化"""
+    with open(f_path, 'rb') as f:
+        head = f.read(head_size)
+        inode = os.fstat(f.fileno()).st_ino
+    return {'inode': inode, 'head_size': len(head), 'head_hash': hashlib.sha1(head).hexdigest()}
+
+
+def _incremental_process_file(full_f_name: str, data_dir_path: str, cache: AccumulateCache,
+                              file_checkpoint: Optional[dict], date_start: Optional[datetime] = None,
+                              date_end: Optional[datetime] = None) -> dict:
+    """
+    从上次处理结束的位置继续读取日志，新的汇总记录追加到历史数据
+    :return: 本次处理后的断点
+    """
+    start_offset = 0
+    file_size = os.path.getsize(full_f_name)
+    # 断点记录的inode或日志开头不一致时，日志已被轮转或替换
+    file_unchanged = (file_checkpoint is not None and 'identity' in file_checkpoint and
+                      _file_identity(full_f_name, file_checkpoint['identity']['head_size']) ==
+                      file_checkpoint['identity'])
+    if compression_suffix(full_f_name) is None:
+        file_unchanged = file_unchanged and file_checkpoint['offset'] <= file_size
+    else:
+        # 压缩日志的断点为解压后的位置，只有归档文件未被替换时才能续读
+        file_unchanged = file_unchanged and file_checkpoint.get('file_size') == file_size
+    if file_unchanged and file_checkpoint['accumulate']['interval'] == cache.interval:
+        start_offset = file_checkpoint['offset']
+        cache.load_state(file_checkpoint['accumulate'])
+    # 日志被截断或替换时从头处理并覆盖历史数据
+    reader = LogReader(full_f_name, start_offset, complete_lines_only=True)
+    dumped_data = _accumulate_log(full_f_name, lambda _: reader, {cache.interval: cache}, date_start, date_end)
+    _store_accumulated_data(dumped_data[cache.interval], full_f_name, data_dir_path, append=start_offset > 0)
+    if reader.skipped:
+        logger.warning(f'{reader.skipped} malformed lines skipped in {full_f_name}')
+    return {'offset': reader.offset, 'file_size': file_size, 'identity': _file_identity(full_f_name),
+            'accumulate': cache.state()}
+
 
 def data_process_and_storage(dir_path: str,
                              lane_ids: List[int],
                              date_start: Optional[datetime] = None,
                              date_end: Optional[datetime] = None,
-                             accumulate_interval_hour: int = 1):
+                             accumulate_interval_hour: int = 1,
+                             parallel: bool = False,
+                             use_cache: bool = False,
+                             incremental: bool = False):
+    """
+    :param parallel: 是否使用进程池并行解析日志
+    :param use_cache: 是否读取日志的列式缓存，缓存失效时重新解析并保存
+    :param incremental: 增量处理，按断点记录只读取各日志新增的部分并追加到历史数据，此时不使用parallel与use_cache，
+                        非增量处理重写历史数据时删除对应日志的断点，下次增量处理从头开始
+    """
+    reader = _log_reader(parallel, use_cache, date_start, date_end)
+    checkpoint_path = os.path.join(dir_path, CHECKPOINT_FILE)
+    checkpoint = _load_checkpoint(checkpoint_path)
     for file_n in os.listdir(dir_path):
-        if not file_n.endswith('log'):
+        if not is_log_file(file_n):
             continue
 
-        cache = AccumulateCache(lane_ids, accumulate_interval_hour * 3600)
-        dumped_data = []
         full_f_name = os.path.join(dir_path, file_n)
-        for tf_data in read_file(full_f_name):
-            tf_data = tf_data[0]
-            detect_start_time = tf_data['cycle_start_time']
-            detect_start_local_time = datetime.fromtimestamp(detect_start_time)
-            if date_start is not None and detect_start_local_time.day < date_start.day or \
-                    date_end is not None and detect_start_local_time.day >= date_end.day:
-                continue
-
-            detect_duration = tf_data['cycle_time']
-            for lane_info in tf_data['lanes']:
-                lane_id, volume_hour = lane_volume_retrieve(lane_info, detect_duration)
-                cache.store_data(lane_id, volume_hour)
-
-            record_data, last_update_time = cache.pop_data_query(detect_start_time)
-            if record_data is not None:
-                record_data.update({'start': last_update_time, 'end': detect_start_time})
-                dumped_data.append(record_data)
+        cache = AccumulateCache(lane_ids, accumulate_interval_hour * 3600)
+        if incremental:
+            checkpoint[file_n] = _incremental_process_file(full_f_name, dir_path, cache, checkpoint.get(file_n),
+                                                           date_start, date_end)
+            _dump_checkpoint(checkpoint, checkpoint_path)
+            continue
+        dumped_data = _accumulate_log(full_f_name, reader, {accumulate_interval_hour: cache}, date_start, date_end)
+        _store_accumulated_data(dumped_data[accumulate_interval_hour], full_f_name, dir_path)
+        if checkpoint.pop(file_n, None) is not None:
+            _dump_checkpoint(checkpoint, checkpoint_path)
 
-        field_names = ['start', 'end']
-        field_names.extend(sorted(item for item in dumped_data[0].keys() if item.startswith('lane')))
-        store_date_data(dumped_data, full_f_name, dir_path, field_names)
+
+def data_process_rollups(dir_path: str,
+                         lane_ids: List[int],
+                         rollup_minutes: Sequence[int] = ROLLUP_MINUTES,
+                         date_start: Optional[datetime] = None,
+                         date_end: Optional[datetime] = None,
+                         parallel: bool = False,
+                         use_cache: bool = False):
+    """
+    单次读取每个日志，同时输出多个时间粒度的车道流量，各粒度分别存储在history_{间隔}min目录下，
+    下游可直接选择对应目录使用。各粒度的时间窗按本地时间对齐(如5min整点、日粒度从零点开始)，
+    日志末尾未结束的时间窗不输出
+    :param rollup_minutes: 汇总的时间间隔(min)
+    """
+    reader = _log_reader(parallel, use_cache, date_start, date_end)
+    for file_n in os.listdir(dir_path):
+        if not is_log_file(file_n):
+            continue
+
+        full_f_name = os.path.join(dir_path, file_n)
+        caches = {minute: AlignedAccumulateCache(lane_ids, minute * 60) for minute in rollup_minutes}
+        dumped_data = _accumulate_log(full_f_name, reader, caches, date_start, date_end)
+        for minute, data in dumped_data.items():
+            _store_accumulated_data(data, full_f_name, dir_path, rollup_dir_name(minute))
 
 
 def store_date_data(data: List[dict],
                     f_name: str,
                     data_dir_path: str,
                     field_names: List[str],
-                    saved_dir_name: str = 'history'):
+                    saved_dir_name: str = 'history',
+                    append: bool = False):
     stable_output_dir_path = os.path.join(data_dir_path, saved_dir_name)
     if not os.path.exists(stable_output_dir_path):
         os.mkdir(stable_output_dir_path)
-    head, tail = os.path.split(f_name)
+    head, tail = os.path.split(log_base_name(f_name))  # 压缩日志与原日志输出同名的历史数据
     file_name = '.'.join((os.path.join(head, saved_dir_name, tail), 'csv'))
-    with open(file_name, 'w+', newline='') as csv_file:
+    write_header = not append or not os.path.exists(file_name) or not os.path.getsize(file_name)
+    with open(file_name, 'a' if append else 'w+', newline='') as csv_file:
         writer = csv.DictWriter(csv_file, fieldnames=field_names)
-        writer.writeheader()
+        if write_header:
+            writer.writeheader()
         for row_dict in data:
             writer.writerow(row_dict)
 
@@ -4,11 +4,65 @@
 # @Description :
 
 import csv
+import hashlib
+import json
 import math
 import os
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
 from functools import partial
-from typing import List, Dict, Any, Iterable, Optional
+from typing import List, Dict, Any, Iterable, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+PREDICT_RESTRICT_WEIGHT = 0.7  # 预测超出限制时预测值所占的权重
+HISTORY_MODEL_VERSION = 3
+ONLINE_UPDATE_ALPHA = 0.05  # 在线更新历史流量时新时间窗的权重
+HISTORY_MODEL_SUFFIX = '.model.npz'  # 历史流量模型文件后缀，存放在历史数据目录旁
+HISTORY_RANGE_SUFFIX = '.ranges.json'  # 历史数据文件日期范围的缓存，存放在历史数据目录旁
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+QUANTILE_BIN_WIDTH = 10  # 分位数直方图的分箱宽度(veh/h)
+QUANTILE_BIN_NUM = 300  # 分位数直方图的分箱数量
+TABLE_MINUTES = 24 * 60  # 预计算历史流量表的长度，分辨率为1min
+
+
+def window_flow(tod_flow: np.ndarray, split_interval_hour: float, current_hours: np.ndarray) -> np.ndarray:
+    """
+    HistoryLaneFlow与MultiLaneHistoryFlow的_backward_window_flow使用的插值方式，计算各时刻下一个时间窗的历史流量
+    :param tod_flow: [..., 时段]的时段流量
+    :param current_hours: 时刻(h)，已扣除向后寻找的时间窗
+    :return: [..., 时刻]的历史流量
+    """
+    split_num = tod_flow.shape[-1]
+    current_hours = np.asarray(current_hours, dtype=np.float64) % 24
+    split_index = current_hours / split_interval_hour
+    current_index = split_index.astype(np.int64)
+    next_index = (current_index + 1) % split_num
+    current_window_fraction = (split_index - current_index) / split_interval_hour
+    next_window_fraction = ((next_index - split_index) % 24) / split_interval_hour
+    return tod_flow[..., current_index] * current_window_fraction + tod_flow[..., next_index] * next_window_fraction
+
+
+def table_step(split_interval_hour: float) -> Optional[int]:
+    """一个时段对应的预计算表长度(min)，时段长度不是整分钟时返回None"""
+    step = split_interval_hour * 60
+    return int(round(step)) if abs(step - round(step)) < 1e-9 else None
+
+
+def history_tables(tod_flow: np.ndarray, split_interval_hour: float,
+                   minutes: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    逐分钟的历史流量水平与一阶差分表：
+    level[m]为m分钟时下一个时间窗的历史流量，diff[m] = level[m] - level[m - 时段长度]为对应的历史变化量
+    :param tod_flow: [..., 时段]的时段流量
+    :param minutes: 只计算这些分钟的level(diff需要的前一时段由level补充)，None时计算全天
+    """
+    step = table_step(split_interval_hour)
+    if minutes is None:
+        minutes = np.arange(TABLE_MINUTES)
+    level = window_flow(tod_flow, split_interval_hour, minutes / 60)
+    diff = level - window_flow(tod_flow, split_interval_hour, ((minutes - step) % TABLE_MINUTES) / 60)
+    return level, diff
 
 
 class HistoryLaneFlow:
@@ -21,12 +75,14 @@ class HistoryLaneFlow:
                                                                  date in
                                                                  date_type}
         self.tod_flow: Optional[Dict[str, Dict[int, float]]] = None
+        self._history_tables: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
 
     def append_flow_data(self, flow: int, minute_in_day: int, date_type: str):
         interval_index = round(minute_in_day / 60 / self.split_interval)
         self._tod_flow_cache[date_type][interval_index].append(flow)
 
     def calculate_avg_flow(self):
+        self._history_tables = None
         self.tod_flow = {}
         for date_type, tod_flow in self._tod_flow_cache.items():
             self.tod_flow[date_type] = {}
@@ -38,16 +94,34 @@ class HistoryLaneFlow:
 
     def _backward_window_flow(self, current_hour: float, date_type: str, backward_num: int = 0):
         """向后寻找n个时间窗的历史流量信息, n为0时代表预测当前时间的下一个窗口"""
-        current_hour = (current_hour - backward_num * self.split_interval) % 24
-        split_index = current_hour / self.split_interval
-        current_index = int(split_index)
-        next_index = (current_index + 1) % self.split_num
-        current_window_fraction = (split_index - current_index) / self.split_interval
-        next_window_fraction = ((next_index - split_index) % 24) / self.split_interval
-        current_step_history_flow = self.tod_flow[date_type][current_index]
-        next_step_history_flow = self.tod_flow[date_type][next_index]
-        mixed_flow = current_step_history_flow * current_window_fraction + next_step_history_flow * next_window_fraction
-        return mixed_flow
+        tod_flow = np.array([self.tod_flow[date_type][index] for index in range(self.split_num)], dtype=np.float64)
+        return float(window_flow(tod_flow, self.split_interval, current_hour - backward_num * self.split_interval))
+
+    def history_tables(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """各日期类型逐分钟的历史流量水平与差分表，首次使用时由tod_flow计算"""
+        if self._history_tables is None:
+            self._history_tables = {
+                date_type: history_tables(np.array([tod_flow[index] for index in range(self.split_num)],
+                                                   dtype=np.float64), self.split_interval)
+                for date_type, tod_flow in self.tod_flow.items()}
+        return self._history_tables
+
+    def _history_flow_diff(self, current_hour: float, date_type: str) -> Tuple[float, float, float]:
+        """
+        :return: 下一时间步的历史流量, 当前至下一时间步的历史变化量, 上一至当前时间步的历史变化量
+        """
+        step = table_step(self.split_interval)
+        minute = current_hour * 60
+        if step is not None and abs(minute - round(minute)) < 1e-6:
+            level, diff = self.history_tables()[date_type]
+            minute = int(round(minute)) % TABLE_MINUTES
+            return float(level[minute]), float(diff[minute]), float(diff[(minute - step) % TABLE_MINUTES])
+        # 不在整分钟的时刻直接计算
+        _history_flow_func = partial(self._backward_window_flow, current_hour, date_type)
+        history_next_flow = _history_flow_func(0)
+        history_current_flow = _history_flow_func(1)
+        return (history_next_flow, history_next_flow - history_current_flow,
+                history_current_flow - _history_flow_func(2))
 
     def predict_one_step(self, current_hour: float, current_flow: float, date_type: str, last_step_flow: float = None,
                          restrict_diff: float = 200):
@@ -63,27 +137,305 @@ class HistoryLaneFlow:
         Returns:
             下一时间步预测流量
         """
-        _history_flow_func = partial(self._backward_window_flow, current_hour, date_type)
-        history_next_flow = _history_flow_func(0)
-        history_current_flow = _history_flow_func(1)
+        history_next_flow, history_next_diff, history_diff = self._history_flow_diff(current_hour, date_type)
         if last_step_flow is not None:
             current_diff = current_flow - last_step_flow
-            history_diff = history_current_flow - _history_flow_func(2)
-            history_next_diff = history_next_flow - history_current_flow
             belief_factor = math.exp(- abs(current_diff - history_diff) / abs(history_diff))  # 限制在0-1区间内
             # 利用历史的变化, 和实际前一时间步的变化进行加权得到预测变化, 前一时间步变化差异越大, 实时变化所占权重越高
             predict_next_diff = history_next_diff * belief_factor + current_diff * (1 - belief_factor)
         else:
-            predict_next_diff = history_next_flow - history_current_flow
+            predict_next_diff = history_next_diff
         predict_flow = current_flow + predict_next_diff
-        RESTRICT_WEIGHT = 0.7
         if predict_flow <= 0:
-            predict_flow = history_next_flow * RESTRICT_WEIGHT
+            predict_flow = history_next_flow * PREDICT_RESTRICT_WEIGHT
         if abs(predict_flow - history_next_flow) > restrict_diff:
-            predict_flow = predict_flow * RESTRICT_WEIGHT + history_next_flow * (1 - RESTRICT_WEIGHT)
+            predict_flow = predict_flow * PREDICT_RESTRICT_WEIGHT + history_next_flow * (1 - PREDICT_RESTRICT_WEIGHT)
         return predict_flow
 
 
+def predict_from_history(current_flow: np.ndarray, last_step_flow: np.ndarray, history_next_flow: np.ndarray,
+                         history_next_diff: np.ndarray, history_diff: np.ndarray, restrict_diff: float = 200,
+                         restrict_weight: float = PREDICT_RESTRICT_WEIGHT) -> np.ndarray:
+    """
+    由实测流量与对应时间窗的历史流量逐元素计算预测流量，计算方式与HistoryLaneFlow.predict_one_step一致
+    Args:
+        current_flow: 当前检测流量
+        last_step_flow: 上一时间步的流量, 无记录时为nan
+        history_next_flow: 下一时间步的历史流量
+        history_next_diff: 当前时间步至下一时间步的历史变化量
+        history_diff: 上一时间步至当前时间步的历史变化量
+        restrict_diff: 限制预测和历史下一步时间流量的最大变化值, 超出则进行一个插值修正
+        restrict_weight: 超出限制时预测值所占的权重
+
+    Returns:
+        下一时间步预测流量
+    """
+    predict_next_diff = history_next_diff
+    current_diff = current_flow - last_step_flow
+    with np.errstate(divide='ignore', invalid='ignore'):
+        belief_factor = np.exp(- np.abs(current_diff - history_diff) / np.abs(history_diff))
+    # 历史无变化时，实际变化同样为0则完全相信历史，否则完全采用实际变化
+    belief_factor = np.where(history_diff == 0, (current_diff == 0).astype(np.float64), belief_factor)
+    predict_next_diff = np.where(np.isnan(last_step_flow), predict_next_diff,
+                                 predict_next_diff * belief_factor + current_diff * (1 - belief_factor))
+    predict_flow = current_flow + predict_next_diff
+    predict_flow = np.where(predict_flow <= 0, history_next_flow * restrict_weight, predict_flow)
+    return np.where(np.abs(predict_flow - history_next_flow) > restrict_diff,
+                    predict_flow * restrict_weight + history_next_flow * (1 - restrict_weight), predict_flow)
+
+
+class FlowQuantileSketch:
+    def __init__(self, shape: Tuple[int, ...], bin_width: float = QUANTILE_BIN_WIDTH, bin_num: int = QUANTILE_BIN_NUM,
+                 counts: Optional[np.ndarray] = None):
+        """
+        固定分箱的流量直方图，按单元(如[日期类型, 车道, 时段])估计分位数，内存与样本数量无关，可直接相加合并
+        :param shape: 单元数组的形状
+        :param bin_width: 分箱宽度(veh/h)
+        :param bin_num: 分箱数量，超出bin_width * bin_num的流量计入最后一个分箱
+        :param counts: 已有的分箱计数，形状为shape + (bin_num,)
+        """
+        self.shape = tuple(shape)
+        self.bin_width = bin_width
+        self.bin_num = bin_num
+        if counts is None:
+            counts = np.zeros(self.shape + (bin_num,), dtype=np.int32)
+        elif counts.shape != self.shape + (bin_num,):
+            raise ValueError(f'sketch counts shape {counts.shape} mismatch {self.shape + (bin_num,)}')
+        self.counts = counts
+
+    def bin_index(self, flow: np.ndarray) -> np.ndarray:
+        return np.clip(np.asarray(flow) // self.bin_width, 0, self.bin_num - 1).astype(np.int64)
+
+    def add(self, cell_index: Tuple[np.ndarray, ...], flow: np.ndarray):
+        """将流量计入各自单元，cell_index为各维度的下标数组"""
+        np.add.at(self.counts, tuple(cell_index) + (self.bin_index(flow),), 1)
+
+    def merge(self, other: 'FlowQuantileSketch') -> 'FlowQuantileSketch':
+        if (other.shape, other.bin_width, other.bin_num) != (self.shape, self.bin_width, self.bin_num):
+            raise ValueError('cannot merge quantile sketches with different shape or bins')
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q: float) -> np.ndarray:
+        """
+        各单元的q分位数，在所在分箱内线性插值，无样本的单元为0
+        """
+        cum_counts = np.cumsum(self.counts, axis=-1)
+        total = cum_counts[..., -1]
+        target = q * total
+        bin_index = np.minimum((cum_counts < target[..., None]).sum(axis=-1), self.bin_num - 1)
+        bin_count = np.take_along_axis(self.counts, bin_index[..., None], axis=-1)[..., 0]
+        below = np.take_along_axis(cum_counts, bin_index[..., None], axis=-1)[..., 0] - bin_count
+        fraction = np.divide(target - below, bin_count, out=np.zeros(self.shape), where=bin_count > 0)
+        return np.where(total > 0, (bin_index + fraction) * self.bin_width, 0.)
+
+
+class MultiLaneHistoryFlow:
+    def __init__(self, lane_ids: Sequence[int], split_interval_hour: float, date_type: Iterable[str],
+                 tod_flow: Optional[np.ndarray] = None, tod_var: Optional[np.ndarray] = None,
+                 sketch: Optional[FlowQuantileSketch] = None):
+        """
+        全部车道的历史时段流量，以[日期类型, 车道, 时段]数组存储，批量预测全部车道
+        :param lane_ids: 车道id
+        :param split_interval_hour: 时段长度(h)
+        :param date_type: 日期类型
+        :param tod_flow: 各日期类型、车道、时段的平均流量，None时全部为0
+        :param tod_var: 与tod_flow对应的流量方差，None时全部为0
+        :param sketch: 各日期类型、车道、时段的流量分位数直方图，None时不能以分位数作为历史流量
+        """
+        assert 24 % split_interval_hour == 0, f'分割时段长度{split_interval_hour}h 不能使单日被整除'
+        self.lane_ids = list(lane_ids)
+        self.split_interval = split_interval_hour
+        self.split_num = int(24 // split_interval_hour)
+        self.date_types = list(date_type)
+        self._lane_index = {lane_id: index for index, lane_id in enumerate(self.lane_ids)}
+        self._date_type_index = {d_type: index for index, d_type in enumerate(self.date_types)}
+        shape = (len(self.date_types), len(self.lane_ids), self.split_num)
+        if tod_flow is None:
+            tod_flow = np.zeros(shape, dtype=np.float64)
+        elif tod_flow.shape != shape:
+            raise ValueError(f'tod flow shape {tod_flow.shape} mismatch {shape}')
+        if tod_var is None:
+            tod_var = np.zeros(shape, dtype=np.float64)
+        elif tod_var.shape != shape:
+            raise ValueError(f'tod var shape {tod_var.shape} mismatch {shape}')
+        if sketch is not None and sketch.shape != shape:
+            raise ValueError(f'quantile sketch shape {sketch.shape} mismatch {shape}')
+        self.tod_flow = tod_flow
+        self.tod_var = tod_var
+        self.sketch = sketch
+        self._quantile_flow: Dict[float, np.ndarray] = {}  # 分位数流量的缓存
+        # 逐分钟的历史流量水平与差分表，键为分位数(None为平均流量)
+        self._history_tables: Dict[Optional[float], Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_lane_flows(cls, history_lane_flow: Dict[int, HistoryLaneFlow]) -> 'MultiLaneHistoryFlow':
+        """由已计算平均流量的各车道HistoryLaneFlow构建"""
+        lane_flows = list(history_lane_flow.values())
+        date_types = list(lane_flows[0].tod_flow.keys())
+        model = cls(history_lane_flow.keys(), lane_flows[0].split_interval, date_types)
+        for lane_index, lane_flow in enumerate(lane_flows):
+            for type_index, d_type in enumerate(date_types):
+                model.tod_flow[type_index, lane_index] = [lane_flow.tod_flow[d_type][split_index]
+                                                          for split_index in range(model.split_num)]
+        return model
+
+    def save(self, file_path: str, key: str = ''):
+        """
+        以npz格式保存模型，先写入临时文件再替换，保证中断时模型文件完整
+        :param key: 输入数据的标识，读取时用于判断模型是否过期
+        """
+        tmp_path = file_path + '.tmp'
+        sketch_fields = {} if self.sketch is None else {
+            'sketch_counts': self.sketch.counts, 'sketch_bin_width': self.sketch.bin_width}
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=HISTORY_MODEL_VERSION, key=key, lane_ids=np.array(self.lane_ids, dtype=np.int64),
+                     split_interval=self.split_interval, date_types=np.array(self.date_types, dtype=str),
+                     tod_flow=self.tod_flow, tod_var=self.tod_var, **sketch_fields)
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str, key: Optional[str] = None) -> Optional['MultiLaneHistoryFlow']:
+        """读取模型，版本不一致或key不一致时返回None"""
+        with np.load(file_path) as model:
+            if int(model['version']) != HISTORY_MODEL_VERSION or key is not None and str(model['key']) != key:
+                return None
+            sketch = None
+            if 'sketch_counts' in model:
+                counts = model['sketch_counts']
+                sketch = FlowQuantileSketch(counts.shape[:-1], float(model['sketch_bin_width']), counts.shape[-1],
+                                            counts)
+            return cls(model['lane_ids'].tolist(), float(model['split_interval']), model['date_types'].tolist(),
+                       model['tod_flow'], model['tod_var'], sketch)
+
+    def to_lane_flows(self) -> Dict[int, HistoryLaneFlow]:
+        """转换为按车道的HistoryLaneFlow"""
+        history_lane_flow = {}
+        for lane_index, lane_id in enumerate(self.lane_ids):
+            lane_flow = HistoryLaneFlow(lane_id, self.split_interval, self.date_types)
+            lane_flow.tod_flow = {d_type: dict(enumerate(self.tod_flow[type_index, lane_index].tolist()))
+                                  for type_index, d_type in enumerate(self.date_types)}
+            history_lane_flow[lane_id] = lane_flow
+        return history_lane_flow
+
+    def lane_indices(self, lane_ids: Sequence[int]) -> np.ndarray:
+        return np.array([self._lane_index[lane_id] for lane_id in lane_ids], dtype=np.int64)
+
+    def quantile_flow(self, q: float) -> np.ndarray:
+        """各日期类型、车道、时段的q分位数流量"""
+        if q not in self._quantile_flow:
+            if self.sketch is None:
+                raise ValueError('history flow built without quantile sketch')
+            self._quantile_flow[q] = self.sketch.quantile(q)
+        return self._quantile_flow[q]
+
+    def split_index(self, minute_in_day: float) -> int:
+        """时间窗开始时刻所属时段，与HistoryLaneFlow.append_flow_data的取整一致"""
+        return round(minute_in_day / 60 / self.split_interval) % self.split_num
+
+    def update_online(self, minute_in_day: float, date_type: str, flow: np.ndarray,
+                      lane_ids: Optional[Sequence[int]] = None, alpha: float = ONLINE_UPDATE_ALPHA):
+        """
+        将一个已结束时间窗的车道流量以指数加权的方式并入对应时段的均值与方差，使历史流量跟随季节变化
+        :param minute_in_day: 时间窗开始时刻的日内分钟
+        :param date_type: 日期类型
+        :param flow: 各车道时间窗内的平均流量
+        :param lane_ids: flow对应的车道, None时为全部车道
+        :param alpha: 新时间窗的权重
+        """
+        lane_index = self.lane_indices(lane_ids) if lane_ids is not None else np.arange(len(self.lane_ids))
+        cell = (self._date_type_index[date_type], lane_index, self.split_index(minute_in_day))
+        diff = np.asarray(flow, dtype=np.float64) - self.tod_flow[cell]
+        increment = alpha * diff
+        self.tod_flow[cell] += increment
+        self.tod_var[cell] = (1 - alpha) * (self.tod_var[cell] + diff * increment)
+        if self.sketch is not None:
+            self.sketch.add(np.broadcast_arrays(*cell), flow)
+            self._quantile_flow.clear()
+            self._history_tables = {None: self._history_tables[None]} if None in self._history_tables else {}
+        self._refresh_history_tables(*cell)
+
+    def history_tables(self, quantile: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """[日期类型, 车道, 分钟]的历史流量水平与差分表，首次使用时计算"""
+        if quantile not in self._history_tables:
+            tod_flow = self.tod_flow if quantile is None else self.quantile_flow(quantile)
+            self._history_tables[quantile] = history_tables(tod_flow, self.split_interval)
+        return self._history_tables[quantile]
+
+    def _refresh_history_tables(self, type_index: int, lane_index: np.ndarray, split_index: int):
+        """时段split_index的流量变化后，只重新计算平均流量表中受影响的分钟"""
+        if None not in self._history_tables:
+            return None
+        level, diff = self._history_tables[None]
+        step = table_step(self.split_interval)
+        # level取决于所在时段及下一时段，diff还取决于前一时段的level
+        minutes = np.unique(np.arange((split_index - 1) * step, (split_index + 2) * step) % TABLE_MINUTES)
+        lane_rows = lane_index[:, None]
+        level[type_index, lane_rows, minutes], diff[type_index, lane_rows, minutes] = history_tables(
+            self.tod_flow[type_index, lane_index], self.split_interval, minutes)
+
+    def _backward_window_flow(self, current_hour: float, date_type: str, backward_num: int = 0,
+                              lane_indices: Optional[np.ndarray] = None,
+                              tod_flow: Optional[np.ndarray] = None) -> np.ndarray:
+        """与HistoryLaneFlow._backward_window_flow一致，返回各车道的历史流量，tod_flow为None时使用平均流量"""
+        type_flow = (self.tod_flow if tod_flow is None else tod_flow)[self._date_type_index[date_type]]
+        if lane_indices is not None:
+            type_flow = type_flow[lane_indices]
+        return window_flow(type_flow, self.split_interval, current_hour - backward_num * self.split_interval)
+
+    def window_flow_table(self, current_hours: np.ndarray, backward_num: int = 0,
+                          tod_flow: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        批量计算多个时刻的_backward_window_flow
+        :return: [日期类型, 车道, 时刻]的历史流量
+        """
+        tod_flow = self.tod_flow if tod_flow is None else tod_flow
+        return window_flow(tod_flow, self.split_interval,
+                           np.asarray(current_hours, dtype=np.float64) - backward_num * self.split_interval)
+
+    def predict_one_step(self, current_hour: float, current_flow: np.ndarray, date_type: str,
+                         last_step_flow: Optional[np.ndarray] = None, restrict_diff: float = 200,
+                         lane_ids: Optional[Sequence[int]] = None, quantile: Optional[float] = None) -> np.ndarray:
+        """
+        批量预测各车道下一个时间步的流量，逐车道结果与HistoryLaneFlow.predict_one_step一致
+        Args:
+            current_hour: 当前时间(h)
+            current_flow: 各车道当前检测流量
+            date_type: 当前日期类型
+            last_step_flow: 各车道上一时间步的流量, 无记录的车道为nan
+            restrict_diff: 限制预测和历史下一步时间流量的最大变化值, 超出则进行一个插值修正
+            lane_ids: current_flow对应的车道, None时为全部车道
+            quantile: 以该分位数流量作为历史流量, None时使用平均流量
+
+        Returns:
+            各车道下一时间步预测流量
+        """
+        lane_indices = self.lane_indices(lane_ids) if lane_ids is not None else slice(None)
+        current_flow = np.asarray(current_flow, dtype=np.float64)
+        if last_step_flow is None:
+            last_step_flow = np.full_like(current_flow, np.nan)
+        step = table_step(self.split_interval)
+        minute = current_hour * 60
+        if step is not None and abs(minute - round(minute)) < 1e-6:
+            level, diff = self.history_tables(quantile)
+            type_index = self._date_type_index[date_type]
+            minute = int(round(minute)) % TABLE_MINUTES
+            history_next_flow = level[type_index, lane_indices, minute]
+            history_next_diff = diff[type_index, lane_indices, minute]
+            history_diff = diff[type_index, lane_indices, (minute - step) % TABLE_MINUTES]
+        else:
+            # 不在整分钟的时刻直接计算
+            tod_flow = self.quantile_flow(quantile) if quantile is not None else None
+            _history_flow_func = partial(self._backward_window_flow, current_hour, date_type,
+                                         lane_indices=lane_indices, tod_flow=tod_flow)
+            history_next_flow = _history_flow_func(0)
+            history_current_flow = _history_flow_func(1)
+            history_next_diff = history_next_flow - history_current_flow
+            history_diff = history_current_flow - _history_flow_func(2)
+        return predict_from_history(current_flow, np.asarray(last_step_flow, dtype=np.float64), history_next_flow,
+                                    history_next_diff, history_diff, restrict_diff)
+
+
 def load_mature_data(file_path: str):
     with open(file_path, 'r+', newline='') as csv_f:
         csv_reader = csv.DictReader(csv_f)
@@ -91,34 +443,426 @@ def load_mature_data(file_path: str):
         for row in csv_reader:
             start_time = datetime.fromtimestamp(int(row.pop('start')))
             end_time = datetime.fromtimestamp(int(row.pop('end')))
-            date = start_time.day
+            date = start_time.date()
             minute_in_day = start_time.hour * 60 + start_time.minute
             date_minute_sorted_data.setdefault(date, {})[minute_in_day] = row
         # print(date_minute_sorted_data.keys())
         return date_minute_sorted_data
 
 
-def date_classify_date(mature_data_dir_path: str, date_class: Dict[Any, List[int]], split_interval_hour: float,
-                       lane_ids: List[int]) -> Dict[int, HistoryLaneFlow]:
-    date_type_assemble_avg_flow: Dict[int, HistoryLaneFlow] = {lane_id: HistoryLaneFlow(lane_id, split_interval_hour,
-                                                                                        date_class.keys())
-                                                               for lane_id in lane_ids}
-    for data_name in os.listdir(mature_data_dir_path):
-        date_minute_sorted_data = load_mature_data(os.path.join(mature_data_dir_path, data_name))
-        for date, minute_data in date_minute_sorted_data.items():
-            for d_type, dates in date_class.items():
-                if date in dates:
-                    this_date_type = d_type
-                    break
-            else:
-                raise ValueError(f'no specific date type for date {date}')
-
-            for minute_in_day, flow_data in minute_data.items():
-                for lane_id, flow in flow_data.items():
-                    lane_num_id = int(''.join(filter(lambda x: x.isnumeric(), lane_id)))
-                    date_type_assemble_avg_flow[lane_num_id].append_flow_data(int(flow), minute_in_day, this_date_type)
+def date_type_of(date_class: Dict[Any, List[Union[int, date]]], day: date):
+    """
+    日期所属的日期类型，按date_class的顺序匹配第一个包含该日期的类型
+    :param date_class: 日期类型为键，对应的日期为值，日期可以为具体的date或月中的日(int)
+    """
+    for d_type, dates in date_class.items():
+        if day in dates or day.day in dates:
+            return d_type
+    raise ValueError(f'no specific date type for date {day}')
+
+
+def _local_time_offsets(timestamps: np.ndarray) -> np.ndarray:
+    """各时间戳的本地时区偏移(s)，每个整点只计算一次，时区偏移只在整点变化"""
+    hour_stamps, inverse = np.unique(timestamps // 3600 * 3600, return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(stamp).astimezone().utcoffset().total_seconds()
+                        for stamp in hour_stamps.tolist()], dtype=np.int64)
+    return offsets[inverse.reshape(-1)]
+
+
+def load_mature_array(file_path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    一次性读取历史数据文件为数组，与load_mature_data一致，同一日期、时刻的重复记录保留最后一条
+    :return: 每条记录的日期序号(date.toordinal), 日内分钟, 车道id, [记录, 车道]流量
+    """
+    with open(file_path, 'r', newline='') as csv_f:
+        header = csv_f.readline().strip().split(',')
+        rows = np.loadtxt(csv_f, delimiter=',', dtype=np.int64, ndmin=2)
+    lane_columns = [index for index, name in enumerate(header) if name.startswith('lane')]
+    lane_ids = np.array([int(header[index][len('lane'):]) for index in lane_columns], dtype=np.int64)
+    if not len(rows):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, lane_ids, np.zeros((0, len(lane_ids)), dtype=np.int64)
+
+    start_time = rows[:, header.index('start')]
+    local_seconds = start_time + _local_time_offsets(start_time)
+    local_day, second_in_day = np.divmod(local_seconds, 86400)
+    date_ordinal = local_day + EPOCH_ORDINAL
+    minute_in_day = second_in_day // 60
+    # 重复的(日期, 分钟)保留最后一条
+    _, last_index = np.unique((date_ordinal * 1440 + minute_in_day)[::-1], return_index=True)
+    keep = np.sort(len(rows) - 1 - last_index)
+    return date_ordinal[keep], minute_in_day[keep], lane_ids, rows[keep][:, lane_columns]
+
+
+class RollingHistoryStore:
+    def __init__(self, lane_ids: Sequence[int], split_interval_hour: float, window_days: Optional[int] = None,
+                 capacity: int = 64, quantile_bin_width: Optional[float] = None,
+                 date_class: Optional[Dict[Any, List[Union[int, date]]]] = None, keep_day_bins: bool = False):
+        """
+        按完整日期、车道、时段存储流量的整数和、平方和与数量，只保留最近window_days天的数据
+        :param lane_ids: 车道id
+        :param split_interval_hour: 时段长度(h)
+        :param window_days: 保留的天数(以已存储的最新日期为准)，None时不淘汰
+        :param capacity: 初始可存储的天数
+        :param quantile_bin_width: 同时按[日期类型, 车道, 时段]存储流量的分位数直方图，并指定分箱宽度，None时不存储
+        :param date_class: 分位数直方图的日期类型划分，存储分位数直方图时必须指定
+        :param keep_day_bins: 保留各日样本所在的分箱，用于逐日留一回测的分位数流量；
+                              指定window_days时总是保留，用于淘汰日期时从直方图中扣除
+        """
+        assert 24 % split_interval_hour == 0, f'分割时段长度{split_interval_hour}h 不能使单日被整除'
+        if quantile_bin_width is not None and date_class is None:
+            raise ValueError('quantile sketch requires date_class to aggregate by date type')
+        self.lane_ids = list(lane_ids)
+        self.split_interval = split_interval_hour
+        self.split_num = int(24 // split_interval_hour)
+        self.window_days = window_days
+        self.date_class = date_class
+        self._lane_index = {lane_id: index for index, lane_id in enumerate(self.lane_ids)}
+        self._day_row: Dict[int, int] = {}  # 日期序号 -> 数组行
+        self._free_rows: List[int] = []
+        self.newest_ordinal: Optional[int] = None
+        if window_days is not None:
+            capacity = min(capacity, window_days)
+        shape = (capacity, len(self.lane_ids), self.split_num)
+        self._flow_sum = np.zeros(shape, dtype=np.int64)
+        self._flow_square_sum = np.zeros(shape, dtype=np.int64)
+        self._flow_count = np.zeros(shape, dtype=np.int32)
+        self.sketch: Optional[FlowQuantileSketch] = None
+        self._day_type: Dict[int, int] = {}  # 日期序号 -> 日期类型下标，仅存储分位数直方图时记录
+        self._day_bins: Optional[Dict[int, List[np.ndarray]]] = None  # 日期序号 -> 样本在[车道, 时段, 分箱]中的下标
+        if quantile_bin_width is not None:
+            self.sketch = FlowQuantileSketch((len(date_class), len(self.lane_ids), self.split_num), quantile_bin_width)
+            if keep_day_bins or window_days is not None:
+                self._day_bins = {}
+
+    @property
+    def dates(self) -> List[date]:
+        return [date.fromordinal(ordinal) for ordinal in sorted(self._day_row)]
+
+    def _type_sketch_counts(self, type_index: int) -> np.ndarray:
+        """日期类型的直方图计数，展平为[车道 * 时段 * 分箱]的视图"""
+        return self.sketch.counts[type_index].reshape(-1)
+
+    def _evict(self):
+        """淘汰超出滚动窗口的日期，其所在行留待复用"""
+        if self.window_days is None:
+            return None
+        oldest_kept = self.newest_ordinal - self.window_days + 1
+        for ordinal in [ordinal for ordinal in self._day_row if ordinal < oldest_kept]:
+            row = self._day_row.pop(ordinal)
+            self._flow_sum[row] = 0
+            self._flow_square_sum[row] = 0
+            self._flow_count[row] = 0
+            if self.sketch is not None:
+                day_bins = self._day_bins.pop(ordinal)
+                type_counts = self._type_sketch_counts(self._day_type.pop(ordinal))
+                for bins in day_bins:
+                    np.add.at(type_counts, bins, -1)
+            self._free_rows.append(row)
+
+    def _allocate_row(self, ordinal: int) -> int:
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._day_row)
+            if row >= len(self._flow_count):  # 容量不足时翻倍，不超过滚动窗口的天数
+                grow = len(self._flow_count)
+                if self.window_days is not None:
+                    grow = min(grow, self.window_days - row)
+                self._flow_sum = np.concatenate([self._flow_sum, np.zeros_like(self._flow_sum[:grow])])
+                self._flow_square_sum = np.concatenate([self._flow_square_sum,
+                                                        np.zeros_like(self._flow_square_sum[:grow])])
+                self._flow_count = np.concatenate([self._flow_count, np.zeros_like(self._flow_count[:grow])])
+        self._day_row[ordinal] = row
+        if self.sketch is not None:
+            type_lookup = {d_type: index for index, d_type in enumerate(self.date_class)}
+            self._day_type[ordinal] = type_lookup[date_type_of(self.date_class, date.fromordinal(ordinal))]
+            if self._day_bins is not None:
+                self._day_bins[ordinal] = []
+        return row
+
+    def add(self, date_ordinal: np.ndarray, minute_in_day: np.ndarray, lane_ids: Sequence[int], flows: np.ndarray):
+        """
+        存储一组记录，格式与load_mature_array的返回一致，早于滚动窗口的记录被忽略
+        """
+        if not len(date_ordinal):
+            return None
+        newest = int(date_ordinal.max())
+        if self.newest_ordinal is None or newest > self.newest_ordinal:
+            self.newest_ordinal = newest
+            self._evict()
+        if self.window_days is not None:
+            in_window = date_ordinal > self.newest_ordinal - self.window_days
+            date_ordinal, minute_in_day, flows = date_ordinal[in_window], minute_in_day[in_window], flows[in_window]
+            if not len(date_ordinal):
+                return None
+
+        unique_ordinals, day_inverse = np.unique(date_ordinal, return_inverse=True)
+        day_inverse = day_inverse.reshape(-1)
+        unique_rows = np.array([self._day_row[ordinal] if ordinal in self._day_row else self._allocate_row(ordinal)
+                                for ordinal in unique_ordinals.tolist()], dtype=np.int64)
+        day_rows = unique_rows[day_inverse]
+        # 与HistoryLaneFlow.append_flow_data一致的时段取整，午夜前半个时段归入次日首个时段
+        split_index = np.round(minute_in_day / 60 / self.split_interval).astype(np.int64) % self.split_num
+        lane_index = np.array([self._lane_index.get(lane_id, -1) for lane_id in lane_ids], dtype=np.int64)
+        valid = lane_index >= 0  # 忽略不在lane_ids中的车道
+        cell_index = (lane_index[valid] * self.split_num + split_index[:, None]).ravel()  # [车道, 时段]中的下标
+        flat_index = np.repeat(day_rows, valid.sum()) * len(self.lane_ids) * self.split_num + cell_index
+        lane_flows = flows[:, valid].ravel()
+        np.add.at(self._flow_sum.reshape(-1), flat_index, lane_flows)
+        np.add.at(self._flow_square_sum.reshape(-1), flat_index, lane_flows ** 2)
+        np.add.at(self._flow_count.reshape(-1), flat_index, 1)
+        if self.sketch is not None:
+            sample_day = np.repeat(day_inverse, valid.sum())
+            sample_type = np.array([self._day_type[ordinal] for ordinal in unique_ordinals.tolist()],
+                                   dtype=np.int64)[sample_day]
+            bin_index = cell_index * self.sketch.bin_num + self.sketch.bin_index(lane_flows)
+            np.add.at(self.sketch.counts.reshape(len(self.date_class), -1), (sample_type, bin_index), 1)
+            if self._day_bins is not None:
+                order = np.argsort(sample_day, kind='stable')
+                day_bins = np.split(bin_index[order].astype(np.int32),
+                                    np.cumsum(np.bincount(sample_day, minlength=len(unique_ordinals)))[:-1])
+                for ordinal, bins in zip(unique_ordinals.tolist(), day_bins):
+                    if len(bins):
+                        self._day_bins[ordinal].append(bins)
+
+    def add_file(self, file_path: str):
+        self.add(*load_mature_array(file_path))
+
+    def daily_flow(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: 按时间排序的日期序号, [日期, 车道, 时段]平均流量(无数据为nan)
+        """
+        ordinals = np.array(sorted(self._day_row), dtype=np.int64)
+        rows = [self._day_row[ordinal] for ordinal in ordinals.tolist()]
+        flow = np.full((len(rows), len(self.lane_ids), self.split_num), np.nan)
+        count = self._flow_count[rows]
+        np.divide(self._flow_sum[rows], count, out=flow, where=count > 0)
+        return ordinals, flow
+
+    def _date_type_stats(self, date_class: Dict[Any, List[Union[int, date]]]
+                         ) -> Tuple[List[int], np.ndarray, List[np.ndarray]]:
+        """
+        按日期类型汇总已存储日期的流量和、平方和与数量
+        :return: 按时间排序的日期所在行, 各日期的日期类型下标, [日期类型, 车道, 时段]的各统计数组
+        """
+        if self.sketch is not None and date_class != self.date_class:
+            raise ValueError('date class differs from the one of the stored quantile sketch')
+        type_lookup = {d_type: index for index, d_type in enumerate(date_class)}
+        ordinals = sorted(self._day_row)
+        rows = [self._day_row[ordinal] for ordinal in ordinals]
+        type_index = np.array([type_lookup[date_type_of(date_class, date.fromordinal(ordinal))]
+                               for ordinal in ordinals], dtype=np.int64)
+        type_stats = []
+        for day_stat in (self._flow_sum, self._flow_square_sum, self._flow_count):
+            type_stat = np.zeros((len(type_lookup),) + day_stat.shape[1:], dtype=np.int64)
+            for index, row in zip(type_index.tolist(), rows):
+                type_stat[index] += day_stat[row]
+            type_stats.append(type_stat)
+        return rows, type_index, type_stats
+
+    @staticmethod
+    def _fill_moments(flow_sum: np.ndarray, flow_square_sum: np.ndarray, flow_count: np.ndarray,
+                      tod_flow: np.ndarray, tod_var: np.ndarray):
+        """由流量和、平方和与数量计算平均流量与方差，写入tod_flow与tod_var，无数据的单元保持不变"""
+        has_flow = flow_count > 0
+        np.divide(flow_sum, flow_count, out=tod_flow, where=has_flow)
+        np.divide(flow_square_sum, flow_count, out=tod_var, where=has_flow)
+        tod_var -= tod_flow ** 2
+        np.maximum(tod_var, 0, out=tod_var)  # 消除舍入误差产生的负值
+
+    def history_flow(self, date_class: Dict[Any, List[Union[int, date]]]) -> MultiLaneHistoryFlow:
+        """按日期类型汇总已存储的日期，计算各车道、时段的平均流量与方差"""
+        model = MultiLaneHistoryFlow(self.lane_ids, self.split_interval, date_class.keys())
+        _, _, type_stats = self._date_type_stats(date_class)
+        self._fill_moments(*type_stats, model.tod_flow, model.tod_var)
+        if self.sketch is not None:
+            model.sketch = FlowQuantileSketch(self.sketch.shape, self.sketch.bin_width, self.sketch.bin_num,
+                                              self.sketch.counts.copy())
+        return model
+
+    def leave_one_out_flow(self, date_class: Dict[Any, List[Union[int, date]]], quantiles: Sequence[float] = ()
+                           ) -> Tuple[np.ndarray, MultiLaneHistoryFlow]:
+        """
+        逐日留一的历史流量，用于回测时不以被预测的日期建立历史流量
+        :param quantiles: 同时计算的分位数流量，需存储分位数直方图并保留各日样本所在的分箱(keep_day_bins)
+        :return: 按时间排序的日期序号(与daily_flow一致), 以日期序号为日期类型的历史流量模型，
+                 其中各日期为所属日期类型扣除该日后的历史流量，没有其他同类日期数据的时段流量为nan
+        """
+        if quantiles and self._day_bins is None:
+            raise ValueError('leave-one-out quantiles require a quantile sketch with per-day bins kept')
+        rows, type_index, type_stats = self._date_type_stats(date_class)
+        ordinals = sorted(self._day_row)
+        model = MultiLaneHistoryFlow(self.lane_ids, self.split_interval, ordinals)
+        quantile_flow = {q: np.empty(model.tod_flow.shape) for q in quantiles}
+        for day_index, (ordinal, row, type_row) in enumerate(zip(ordinals, rows, type_index.tolist())):
+            held_out = [type_stat[type_row] - day_stat[row] for type_stat, day_stat in
+                        zip(type_stats, (self._flow_sum, self._flow_square_sum, self._flow_count))]
+            self._fill_moments(*held_out, model.tod_flow[day_index], model.tod_var[day_index])
+            model.tod_flow[day_index][held_out[2] == 0] = np.nan
+            if quantiles:
+                counts = self._type_sketch_counts(type_row).copy()
+                for bins in self._day_bins[ordinal]:
+                    np.add.at(counts, bins, -1)
+                held_out_sketch = FlowQuantileSketch(self.sketch.shape[1:], self.sketch.bin_width,
+                                                     self.sketch.bin_num, counts.reshape(self.sketch.counts.shape[1:]))
+                for q, flow in quantile_flow.items():
+                    flow[day_index] = held_out_sketch.quantile(q)
+        for q, flow in quantile_flow.items():
+            flow[np.isnan(model.tod_flow)] = np.nan
+            model._quantile_flow[q] = flow
+        return np.array(ordinals, dtype=np.int64), model
+
+
+def _file_date_range(file_path: str) -> Optional[Tuple[int, int]]:
+    """
+    :return: 历史数据文件中记录的最早与最晚日期序号，没有记录时为None
+    """
+    with open(file_path, 'r', newline='') as csv_f:
+        header = csv_f.readline().strip().split(',')
+        start_time = np.loadtxt(csv_f, delimiter=',', dtype=np.int64, usecols=header.index('start'), ndmin=1)
+    if not len(start_time):
+        return None
+    date_ordinal = (start_time + _local_time_offsets(start_time)) // 86400 + EPOCH_ORDINAL
+    return int(date_ordinal.min()), int(date_ordinal.max())
+
+
+def history_date_ranges(mature_data_dir_path: str, file_paths: List[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+    """
+    各历史数据文件的日期范围，按文件大小与修改时间缓存在历史数据目录旁的.ranges.json中，只重新读取变化的文件
+    """
+    range_path = os.path.normpath(mature_data_dir_path) + HISTORY_RANGE_SUFFIX
+    cached = {}
+    if os.path.exists(range_path):
+        with open(range_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    date_ranges, updated = {}, {}
+    for file_path in file_paths:
+        stat = os.stat(file_path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        name = os.path.basename(file_path)
+        record = cached.get(name)
+        if record is None or record['signature'] != signature:
+            record = {'signature': signature, 'range': _file_date_range(file_path)}
+        updated[name] = record
+        date_ranges[file_path] = tuple(record['range']) if record['range'] is not None else None
+    if updated != cached:
+        tmp_path = range_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(updated, f)
+        os.replace(tmp_path, range_path)
+    return date_ranges
+
+
+def _history_file_paths(mature_data_dir_path: str, window_days: Optional[int] = None) -> List[str]:
+    """
+    历史数据目录下的全部文件，指定window_days时只返回可能包含最近window_days天记录的文件，
+    早于滚动窗口的文件不读取也不参与模型标识的计算
+    """
+    file_paths = [os.path.join(mature_data_dir_path, data_name)
+                  for data_name in sorted(os.listdir(mature_data_dir_path)) if data_name.endswith('.csv')]
+    if window_days is None:
+        return file_paths
+    date_ranges = history_date_ranges(mature_data_dir_path, file_paths)
+    newest = max((date_range[1] for date_range in date_ranges.values() if date_range is not None), default=None)
+    if newest is None:
+        return []
+    return [file_path for file_path, date_range in date_ranges.items()
+            if date_range is not None and date_range[1] > newest - window_days]
+
+
+def build_history_store(mature_data_dir_path: str, split_interval_hour: float, lane_ids: List[int],
+                        window_days: Optional[int] = None, quantile_bin_width: Optional[float] = None,
+                        max_workers: Optional[int] = None,
+                        date_class: Optional[Dict[Any, List[Union[int, date]]]] = None,
+                        keep_day_bins: bool = False) -> RollingHistoryStore:
+    """
+    在进程池中读取历史数据目录下的全部文件至RollingHistoryStore，其余参数含义与RollingHistoryStore一致
+    np.loadtxt解析时持有GIL，使用进程池才能并行解析多个文件
+    :param max_workers: 读取文件的进程数，None时由进程池决定，为1或只有一个文件时在当前进程读取
+    """
+    store = RollingHistoryStore(lane_ids, split_interval_hour, window_days, quantile_bin_width=quantile_bin_width,
+                                date_class=date_class, keep_day_bins=keep_day_bins)
+    file_paths = _history_file_paths(mature_data_dir_path, window_days)
+    if max_workers == 1 or len(file_paths) <= 1:
+        for file_path in file_paths:
+            store.add_file(file_path)
+        return store
+    with ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count() or 1, len(file_paths))) as executor:
+        for file_data in executor.map(load_mature_array, file_paths):
+            store.add(*file_data)
+    return store
+
+
+def load_history_flow(mature_data_dir_path: str, date_class: Dict[Any, List[Union[int, date]]],
+                      split_interval_hour: float, lane_ids: List[int], window_days: Optional[int] = None,
+                      quantile_bin_width: Optional[float] = None,
+                      max_workers: Optional[int] = None) -> MultiLaneHistoryFlow:
+    """
+    在进程池中读取历史数据目录下的全部文件，按日期类型、车道、时段计算平均流量
+    :param date_class: 日期类型为键，对应的日期为值，日期可以为具体的date或月中的日(int)
+    :param window_days: 只使用最近若干天的数据，None时使用全部数据
+    :param quantile_bin_width: 同时统计流量分位数直方图，并指定分箱宽度，None时不统计
+    :param max_workers: 读取文件的进程数，None时由进程池决定
+    """
+    store = build_history_store(mature_data_dir_path, split_interval_hour, lane_ids, window_days, quantile_bin_width,
+                                max_workers, date_class if quantile_bin_width is not None else None)
+    return store.history_flow(date_class)
+
+
+def history_model_path(mature_data_dir_path: str) -> str:
+    return os.path.normpath(mature_data_dir_path) + HISTORY_MODEL_SUFFIX
+
+
+def history_model_key(mature_data_dir_path: str, date_class: Dict[Any, List[Union[int, date]]],
+                      split_interval_hour: float, lane_ids: List[int], window_days: Optional[int] = None,
+                      quantile_bin_width: Optional[float] = None) -> str:
+    """由可能包含滚动窗口内记录的历史数据文件的内容哈希、修改时间与模型参数生成的标识"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'version': HISTORY_MODEL_VERSION,
+                              'date_class': {str(d_type): [str(day) for day in dates]
+                                             for d_type, dates in date_class.items()},
+                              'split_interval_hour': split_interval_hour,
+                              'lane_ids': list(lane_ids),
+                              'window_days': window_days,
+                              'quantile_bin_width': quantile_bin_width}).encode())
+    for file_path in _history_file_paths(mature_data_dir_path, window_days):
+        with open(file_path, 'rb') as f:
+            file_hash = hashlib.sha256(f.read()).hexdigest()
+        digest.update(f'{os.path.basename(file_path)}:{os.stat(file_path).st_mtime_ns}:{file_hash};'.encode())
+    return digest.hexdigest()
+
+
+def load_history_flow_cached(mature_data_dir_path: str, date_class: Dict[Any, List[Union[int, date]]],
+                             split_interval_hour: float, lane_ids: List[int], window_days: Optional[int] = None,
+                             quantile_bin_width: Optional[float] = None, model_path: Optional[str] = None,
+                             rebuild: bool = False) -> MultiLaneHistoryFlow:
+    """
+    读取保存的历史流量模型，历史数据文件或参数变化时重新计算并保存
+    :param window_days: 只使用最近若干天的数据，None时使用全部数据
+    :param quantile_bin_width: 同时统计流量分位数直方图，并指定分箱宽度，None时不统计
+    :param model_path: 模型文件路径，None时为历史数据目录旁的同名.model.npz文件
+    :param rebuild: 是否强制重新计算
+    """
+    if model_path is None:
+        model_path = history_model_path(mature_data_dir_path)
+    key = history_model_key(mature_data_dir_path, date_class, split_interval_hour, lane_ids, window_days,
+                            quantile_bin_width)
+    if not rebuild and os.path.exists(model_path):
+        model = MultiLaneHistoryFlow.load(model_path, key)
+        if model is not None:
+            return model
+    model = load_history_flow(mature_data_dir_path, date_class, split_interval_hour, lane_ids, window_days,
+                              quantile_bin_width)
+    model.save(model_path, key)
+    return model
+
+
+def date_classify_date(mature_data_dir_path: str, date_class: Dict[Any, List[Union[int, date]]],
+                       split_interval_hour: float, lane_ids: List[int]) -> Dict[int, HistoryLaneFlow]:
+    date_type_assemble_avg_flow = load_history_flow(mature_data_dir_path, date_class, split_interval_hour,
+                                                    lane_ids).to_lane_flows()
     for lane_id, lane_flow in date_type_assemble_avg_flow.items():
-        lane_flow.calculate_avg_flow()
         print(lane_id, lane_flow.tod_flow)
 
     return date_type_assemble_avg_flow
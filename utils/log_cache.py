@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# @Time        : 2026/10/17 14:20
+# @File        : log_cache.py
+# @Description : 检测器日志的列式缓存，解析一次后以.npy存储在日志旁，后续以内存映射读取
+import json
+import os
+import shutil
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from utils.process import read_file, read_file_parallel
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.cache'
+META_FILE = 'meta.json'
+BUILD_CHUNK_RECORDS = 65536  # 解析时每批转换为数组的记录数
+READ_BATCH_RECORDS = 4096  # 回放时每批还原为统计记录的记录数
+
+# 周期级字段，每条统计记录一行
+RECORD_COLUMNS = ('cycle_start_time', 'cycle_time', 'lane_offset')
+# 车道级字段，每条记录中的每个车道一行，第i条记录的车道为[lane_offset[i], lane_offset[i+1])
+LANE_COLUMNS = ('lane_no', 'volume', 'queue_num', 'queue_length')
+
+
+def cache_dir_path(f_path: str) -> str:
+    return f_path + CACHE_SUFFIX
+
+
+def file_signature(f_path: str) -> dict:
+    stat = os.stat(f_path)
+    return {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _cache_valid(f_path: str) -> bool:
+    meta_path = os.path.join(cache_dir_path(f_path), META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return all(meta.get(key) == value for key, value in file_signature(f_path).items())
+
+
+def _column_chunk(values: list, dtype) -> np.ndarray:
+    chunk = np.array(values, dtype=dtype)
+    values.clear()
+    return chunk
+
+
+def build_log_columns(f_path: str, parallel: bool = False) -> Dict[str, np.ndarray]:
+    """
+    解析日志为列式数组，只使用statistics中的第一条记录(与各数据使用方一致)
+    每BUILD_CHUNK_RECORDS条记录转换为一段数组，解析过程中只保留一批记录的Python对象
+    :param f_path: 日志路径
+    :param parallel: 是否使用进程池并行解析
+    """
+    dtypes = {'cycle_start_time': np.int64, 'cycle_time': np.float64, 'lane_count': np.int64, 'lane_no': np.int64,
+              'volume': np.float64, 'queue_num': np.float64, 'queue_length': np.float64}
+    values: Dict[str, list] = {name: [] for name in dtypes}
+    chunks: Dict[str, List[np.ndarray]] = {name: [] for name in dtypes}
+    reader = read_file_parallel if parallel else read_file
+    for stat in reader(f_path):
+        tf_data = stat[0]
+        values['cycle_start_time'].append(tf_data['cycle_start_time'])
+        values['cycle_time'].append(tf_data['cycle_time'])
+        values['lane_count'].append(len(tf_data['lanes']))
+        for lane_info in tf_data['lanes']:
+            queue = lane_info.get('queue', lane_info)
+            values['lane_no'].append(lane_info['lane_no'])
+            values['volume'].append(lane_info['volume'])
+            values['queue_num'].append(queue.get('queue_num', np.nan))
+            values['queue_length'].append(queue.get('queue_length', np.nan))
+        if len(values['cycle_start_time']) >= BUILD_CHUNK_RECORDS:
+            for name, dtype in dtypes.items():
+                chunks[name].append(_column_chunk(values[name], dtype))
+    for name, dtype in dtypes.items():
+        chunks[name].append(_column_chunk(values[name], dtype))
+    columns = {name: np.concatenate(chunks.pop(name)) for name in dtypes}
+    columns['lane_offset'] = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(columns.pop('lane_count'))])
+    return columns
+
+
+def store_log_columns(f_path: str, columns: Dict[str, np.ndarray]):
+    """
+    将列式数组写入日志旁的缓存目录，元数据最后写入，保证中断时缓存不会被误用
+    """
+    cache_dir = cache_dir_path(f_path)
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.mkdir(cache_dir)
+    signature = file_signature(f_path)
+    for name, column in columns.items():
+        np.save(os.path.join(cache_dir, name + '.npy'), column)
+    with open(os.path.join(cache_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(signature, f)
+
+
+def load_log_columns(f_path: str, rebuild: bool = False, parallel: bool = False) -> Dict[str, np.ndarray]:
+    """
+    读取日志的列式缓存，缓存不存在或日志大小、修改时间变化时重新解析
+    :param f_path: 日志路径
+    :param rebuild: 是否强制重新解析
+    :param parallel: 重新解析时是否使用进程池
+    :return: 字段名为键的只读内存映射数组
+    """
+    if rebuild or not _cache_valid(f_path):
+        store_log_columns(f_path, build_log_columns(f_path, parallel))
+    cache_dir = cache_dir_path(f_path)
+    return {name: np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r')
+            for name in RECORD_COLUMNS + LANE_COLUMNS}
+
+
+def lane_record_index(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    车道级每一行所属的记录下标，用于将周期级字段展开到车道级
+    """
+    return np.repeat(np.arange(len(columns['cycle_start_time'])), np.diff(columns['lane_offset']))
+
+
+def read_file_cached(f_path: str, parallel: bool = False) -> Iterator[List[dict]]:
+    """
+    由列式缓存还原统计记录，与read_file返回格式一致，供逐条回放使用
+    每次只将READ_BATCH_RECORDS条记录对应的内存映射片段转换为Python对象，内存占用与日志大小无关
+    """
+    columns = load_log_columns(f_path, parallel=parallel)
+    record_num = len(columns['cycle_start_time'])
+    for batch_start in range(0, record_num, READ_BATCH_RECORDS):
+        batch_end = min(batch_start + READ_BATCH_RECORDS, record_num)
+        lane_offset = columns['lane_offset'][batch_start:batch_end + 1].tolist()
+        lane_slice = slice(lane_offset[0], lane_offset[-1])
+        lane_no = columns['lane_no'][lane_slice].tolist()
+        volume = columns['volume'][lane_slice].tolist()
+        queue_num = columns['queue_num'][lane_slice].tolist()
+        queue_length = columns['queue_length'][lane_slice].tolist()
+        start_times = columns['cycle_start_time'][batch_start:batch_end].tolist()
+        durations = columns['cycle_time'][batch_start:batch_end].tolist()
+        for index, (start_time, duration) in enumerate(zip(start_times, durations)):
+            lanes = []
+            for row in range(lane_offset[index] - lane_offset[0], lane_offset[index + 1] - lane_offset[0]):
+                lane_info = {'lane_no': lane_no[row], 'volume': volume[row]}
+                if queue_num[row] == queue_num[row]:  # 非nan
+                    lane_info['queue'] = {'queue_num': queue_num[row], 'queue_length': queue_length[row]}
+                lanes.append(lane_info)
+            yield [{'cycle_start_time': start_time, 'cycle_time': duration, 'lanes': lanes}]
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# @Time        : 2026/10/17 16:05
+# @File        : log_index.py
+# @Description : 检测器日志的时间索引，记录每条记录的cycle_start_time与所在字节位置，用于按时间段读取与任意位置回放
+import os
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from lib.tool import logger
+from utils.log_cache import file_signature
+from utils.process import LogReader, open_log, parse_line
+
+INDEX_SUFFIX = '.idx.npz'
+TIME_KEY = b'"cycle_start_time"'
+
+
+def index_path(f_path: str) -> str:
+    return f_path + INDEX_SUFFIX
+
+
+def _line_cycle_start_time(line: bytes) -> Optional[float]:
+    """
+    不解析完整json，直接扫描cycle_start_time字段的数值，失败时退回完整解析
+    """
+    if not line.startswith(b'['):
+        return None
+    key_pos = line.find(TIME_KEY)
+    if key_pos >= 0:
+        value_start = line.find(b':', key_pos + len(TIME_KEY)) + 1
+        value_end = value_start
+        while value_end < len(line) and line[value_end] not in b',}':
+            value_end += 1
+        try:
+            return float(line[value_start:value_end])
+        except ValueError:
+            pass
+    stat_res = parse_line(line)
+    if not stat_res:
+        return None
+    return stat_res[0]['cycle_start_time']
+
+
+def build_log_index(f_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: 各条记录的cycle_start_time, 记录所在行的起始字节位置(压缩日志为解压后的位置)
+    """
+    times, offsets = [], []
+    offset = 0
+    with open_log(f_path) as f:
+        for line in f:
+            start_time = _line_cycle_start_time(line)
+            if start_time is not None:
+                times.append(start_time)
+                offsets.append(offset)
+            offset += len(line)
+    return np.array(times, dtype=np.float64), np.array(offsets, dtype=np.int64)
+
+
+def load_log_index(f_path: str, rebuild: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    读取日志旁的时间索引，不存在或日志大小、修改时间变化时重新建立
+    """
+    idx_path = index_path(f_path)
+    signature = file_signature(f_path)
+    if not rebuild and os.path.exists(idx_path):
+        with np.load(idx_path) as index:
+            if all(int(index[key]) == value for key, value in signature.items()):
+                return index['time'], index['offset']
+    times, offsets = build_log_index(f_path)
+    np.savez(idx_path, time=times, offset=offsets, **signature)
+    return times, offsets
+
+
+def _timestamp(moment: Union[datetime, float, None]) -> Optional[float]:
+    if isinstance(moment, datetime):
+        return moment.timestamp()
+    return moment
+
+
+def read_file_range(f_path: str, time_start: Union[datetime, float, None] = None,
+                    time_end: Union[datetime, float, None] = None) -> Iterator[List[dict]]:
+    """
+    由时间索引直接定位到time_start所在位置读取，读取到time_end(不包含)为止，返回格式与read_file一致
+    :param f_path: 日志路径
+    :param time_start: 开始时间，None时从头读取
+    :param time_end: 结束时间，None时读取至文件末尾
+    """
+    start_ts, end_ts = _timestamp(time_start), _timestamp(time_end)
+    times, offsets = load_log_index(f_path)
+    monotonic = bool(np.all(np.diff(times) >= 0))
+    if not monotonic:
+        logger.warning(f'cycle_start_time is not monotonic in {f_path}, fall back to full scan')
+    start_offset = 0
+    if monotonic and start_ts is not None:
+        position = int(np.searchsorted(times, start_ts, side='left'))
+        if position == len(offsets):
+            return
+        start_offset = int(offsets[position])
+
+    reader = LogReader(f_path, start_offset)
+    for stat_res in reader:
+        detect_start_time = stat_res[0]['cycle_start_time']
+        if end_ts is not None and detect_start_time >= end_ts:
+            if monotonic:
+                break
+            continue
+        if start_ts is not None and detect_start_time < start_ts:
+            continue
+        yield stat_res
+    if reader.skipped:
+        logger.warning(f'{reader.skipped} malformed lines skipped in {f_path}')
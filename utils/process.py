@@ -2,22 +2,216 @@
 # @Time        : 2023/4/6 19:55
 # @File        : process.py
 # @Description :
-import re
+import bz2
+import gzip
+import io
 import json
+import lzma
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Iterator, List, Tuple, Callable
 
-pattern = re.compile('\[[\s\S]+\]\s([\s\S]+)')
+from lib.tool import logger
+
+try:
+    import orjson  # 可选的快速json解析
+except ImportError:
+    orjson = None
+
+READ_BUFFER_SIZE = 1 << 20  # 日志读取缓冲区大小
+PARALLEL_CHUNK_SIZE = 32 << 20  # 并行解析时每个任务的字节数
+# 支持流式解压读取的压缩日志后缀
+COMPRESSED_OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def compression_suffix(f_path: str) -> Optional[str]:
+    """压缩日志的后缀，未压缩时返回None"""
+    suffix = os.path.splitext(f_path)[1]
+    return suffix if suffix in COMPRESSED_OPENERS else None
+
+
+def log_base_name(f_path: str) -> str:
+    """去除压缩后缀后的日志路径"""
+    suffix = compression_suffix(f_path)
+    return f_path[:-len(suffix)] if suffix is not None else f_path
+
+
+def is_log_file(f_path: str) -> bool:
+    """是否为日志文件(包括压缩的日志)"""
+    return log_base_name(f_path).endswith('log')
+
+
+def open_log(f_path: str) -> io.BufferedIOBase:
+    """
+    以二进制方式打开日志，压缩日志流式解压，偏移量均为解压后的字节位置
+    """
+    suffix = compression_suffix(f_path)
+    if suffix is None:
+        return open(f_path, 'rb', buffering=READ_BUFFER_SIZE)
+    return io.BufferedReader(COMPRESSED_OPENERS[suffix](f_path, 'rb'), buffer_size=READ_BUFFER_SIZE)
+
+
+def _split_payload(line: bytes) -> Optional[bytes]:
+    """
+    去除日志行的方括号前缀，返回其后的json内容，格式不符时返回None
+    """
+    if not line.startswith(b'['):
+        return None
+    prefix_end = line.find(b']')
+    if prefix_end < 0:
+        return None
+    payload_start = line.find(b'{', prefix_end)
+    if payload_start < 0:
+        return None
+    return line[payload_start:]
+
+
+def _json_loads(fast_json: bool) -> Callable[[bytes], dict]:
+    return orjson.loads if fast_json and orjson is not None else json.loads
+
+
+def parse_line(line: bytes, loads: Callable[[bytes], dict] = json.loads) -> Optional[List[dict]]:
+    """
+    解析单行日志，返回statistics字段，格式不符时返回None
+    """
+    payload = _split_payload(line)
+    if payload is None:
+        return None
+    try:
+        return loads(payload)['statistics']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class LogReader:
+    def __init__(self, f_path: str, start_offset: int = 0, complete_lines_only: bool = False):
+        """
+        逐行流式读取日志，跳过格式错误的行并计数
+        :param f_path: 日志路径
+        :param start_offset: 开始读取的字节位置，应为行首
+        :param complete_lines_only: 是否忽略末尾未写完(无换行)的行，用于读取仍在写入的日志
+        """
+        self.f_path = f_path
+        self.skipped = 0  # 跳过的格式错误行数
+        self.offset = start_offset  # 已读取内容的结束字节位置
+        self.complete_lines_only = complete_lines_only
+
+    def __iter__(self) -> Iterator[List[dict]]:
+        with open_log(self.f_path) as f:
+            f.seek(self.offset)
+            for line in f:
+                if self.complete_lines_only and not line.endswith(b'\n'):
+                    break
+                self.offset += len(line)
+                stat_res = parse_line(line)
+                if stat_res is None:
+                    if line.strip():
+                        self.skipped += 1
+                    continue
+                yield stat_res
 
 
 def read_file(f_path):
-    with open(f_path, 'r') as f:
-        for line in f.readlines():
-            match_res = pattern.match(line)
-            res_json_val = match_res.group(1)
-            res_val = json.loads(res_json_val)
-            stat_res = res_val['statistics']
-            yield stat_res
+    reader = LogReader(f_path)
+    yield from reader
+    if reader.skipped:
+        logger.warning(f'{reader.skipped} malformed lines skipped in {f_path}')
+
+
+def line_aligned_ranges(f_path: str, chunk_size: int = PARALLEL_CHUNK_SIZE) -> List[Tuple[int, int]]:
+    """
+    将文件按约chunk_size字节划分为以换行结尾的区间[start, end)
+    """
+    file_size = os.path.getsize(f_path)
+    ranges = []
+    with open(f_path, 'rb') as f:
+        start = 0
+        while start < file_size:
+            f.seek(min(start + chunk_size, file_size))
+            f.readline()  # 移动至下一个换行之后
+            end = min(f.tell(), file_size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _parse_block(block: bytes, fast_json: bool) -> Tuple[List[List[dict]], int]:
+    """
+    进程池任务：解析以换行分隔的若干完整行
+    :return: 各行的statistics, 格式错误行数
+    """
+    loads = _json_loads(fast_json)
+    stats, skipped = [], 0
+    for line in block.split(b'\n'):
+        stat_res = parse_line(line, loads)
+        if stat_res is None:
+            if line.strip():
+                skipped += 1
+            continue
+        stats.append(stat_res)
+    return stats, skipped
+
+
+def _parse_range(f_path: str, start: int, end: int, fast_json: bool) -> Tuple[List[List[dict]], int]:
+    """
+    进程池任务：解析文件区间[start, end)内的全部行
+    """
+    with open(f_path, 'rb') as f:
+        f.seek(start)
+        return _parse_block(f.read(end - start), fast_json)
+
+
+def _decompressed_blocks(f_path: str, chunk_size: int = PARALLEL_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    流式解压日志，按约chunk_size字节切分为以完整行结束的块
+    """
+    with open_log(f_path) as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            block += f.readline()  # 补齐至行尾
+            yield block
+
+
+def read_file_parallel(f_path: str, max_workers: Optional[int] = None, chunk_size: int = PARALLEL_CHUNK_SIZE,
+                       fast_json: bool = True) -> Iterator[List[dict]]:
+    """
+    按换行对齐的字节区间在进程池中并行解析日志，按原有顺序逐条返回，与read_file结果一致，
+    压缩日志在主进程流式解压，解析在进程池中进行
+    :param f_path: 日志路径
+    :param max_workers: 进程数量，None时为CPU数量
+    :param chunk_size: 每个任务的字节数
+    :param fast_json: 安装orjson时使用其解析
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_pending = 2 * max_workers  # 限制已解析未消费的区间数量，控制内存
+    skipped = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        if compression_suffix(f_path) is None:
+            tasks = (executor.submit(_parse_range, f_path, start, end, fast_json)
+                     for start, end in line_aligned_ranges(f_path, chunk_size))
+        else:
+            # 压缩流无法按字节位置定位，在主进程顺序解压后将各块交给进程池解析
+            tasks = (executor.submit(_parse_block, block, fast_json)
+                     for block in _decompressed_blocks(f_path, chunk_size))
+        pending = deque()
+        for task in tasks:
+            pending.append(task)
+            if len(pending) >= max_pending:
+                stats, range_skipped = pending.popleft().result()
+                skipped += range_skipped
+                yield from stats
+        while pending:
+            stats, range_skipped = pending.popleft().result()
+            skipped += range_skipped
+            yield from stats
+    if skipped:
+        logger.warning(f'{skipped} malformed lines skipped in {f_path}')
 
 
 if __name__ == '__main__':
     tf_data_path = 'data/TrafficFlow_Logs2.log'
-    read_file(tf_data_path)
\ No newline at end of file
+    read_file(tf_data_path)